@@ -1,4 +1,5 @@
 from django.contrib.sitemaps import Sitemap
+from django.utils import timezone
 
 from .models import Article
 
@@ -6,12 +7,16 @@ from .models import Article
 class BlogSitemap(Sitemap):
     changefreq = "never"
     priority = 0.5
+    # адрес строки - reverse(url_name, kwargs={"pk": pk})
+    url_name = "blogapp:article"
+    lastmod_field = "pub_date"
 
     def items(self):
         return (
             Article.objects
-            .filter(pub_date__isnull=False)
-            .order_by("-pub_date")[:5]
+            .filter(pub_date__lte=timezone.now())
+            .only("pk", self.lastmod_field)
+            .order_by("pk")
         )
 
     def lastmod(self, obj: Article):
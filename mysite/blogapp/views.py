@@ -1,8 +1,9 @@
-from django.contrib.syndication.views import Feed
+from django.db.models.functions import Substr
 from django.views.generic import ListView, DetailView
 from django.urls import reverse_lazy, reverse
 
 from blogapp.models import Article
+from mysite.feeds import CachedFeed
 
 
 class BasedView(ListView):
@@ -28,15 +29,20 @@ class ArticlesListView(ListView):
 class ArticleDetailView(DetailView):
     model = Article
 
-class LatestArticlesFeed(Feed):
+class LatestArticlesFeed(CachedFeed):
     title = "Blog articles(latets)"
     description = "Update on changes and additon blog acticles"
     link = reverse_lazy("blogapp:articles")
+    timestamp_field = "pub_date"
+
+    def get_queryset(self):
+        return Article.objects.filter(pub_date__isnull=False)
 
     def items(self):
         return (
-            Article.objects
-            .filter(pub_date__isnull=False)
+            self.get_queryset()
+            .only("pk", "title", "pub_date")
+            .annotate(summary=Substr("content", 1, 200))
             .order_by("-pub_date")[:5]
         )
 
@@ -44,7 +50,10 @@ class LatestArticlesFeed(Feed):
         return item.title
 
     def item_description(self, item: Article):
-        return item.content[:200]
+        return item.summary
+
+    def item_pubdate(self, item: Article):
+        return item.pub_date
 
     # def item_link(self, item: Article):
     #     return reverse("blogapp:article", kwargs={"pk":item.pk})
@@ -0,0 +1,21 @@
+# gunicorn -c gunicorn.conf.py
+#
+# DJANGO_ASGI=1 serves mysite.asgi with uvicorn workers: async views
+# (JSON exports) wait on slow clients without holding a worker.
+# Database connections are then closed after each request
+# (CONN_MAX_AGE=0, see the SQLite profile in mysite/settings.py).
+# Otherwise mysite.wsgi runs in sync workers.
+from os import getenv
+
+
+ASGI = getenv("DJANGO_ASGI", "0") == "1"
+
+bind = getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(getenv("GUNICORN_WORKERS", "2"))
+
+if ASGI:
+    wsgi_app = "mysite.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "mysite.wsgi:application"
+    worker_class = "sync"
@@ -0,0 +1,358 @@
+"""
+Бэкенды кеша проекта.
+
+* ``TieredCache`` - двухуровневый кеш: LRU в памяти процесса (L1)
+  перед общим хранилищем (L2, файлы или база);
+* ``Instrumented*`` - бэкенды с замером попаданий, промахов и времени
+  для ``RequestTimingMiddleware``.
+"""
+from collections import OrderedDict
+from functools import wraps
+from time import monotonic, perf_counter, time_ns
+import os
+import pickle
+import threading
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+
+from .instrumentation import current_metrics
+
+
+_MISSING = object()
+
+
+def _timed(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = current_metrics()
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        metrics.cache_depth += 1
+        started = perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics.cache_depth -= 1
+            if not metrics.cache_depth:
+                metrics.cache_calls += 1
+                metrics.cache_ms += (perf_counter() - started) * 1000
+    return wrapper
+
+
+class InstrumentedCacheMixin:
+    """
+    Считает обращения к кешу текущего запроса.
+
+    Внутренние вызовы (``get_many`` через ``get``, ``incr`` через
+    ``get`` и ``set``) учитываются один раз - как вызов верхнего уровня.
+    """
+
+    @_timed
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        metrics = current_metrics()
+        if metrics is not None and metrics.cache_depth == 1:
+            if value is _MISSING:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is _MISSING else value
+
+    @_timed
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = super().get_many(keys, version)
+        metrics = current_metrics()
+        if metrics is not None and metrics.cache_depth == 1:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    @_timed
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return super().set(key, value, timeout, version)
+
+    @_timed
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return super().add(key, value, timeout, version)
+
+    @_timed
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return super().set_many(data, timeout, version)
+
+    @_timed
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return super().touch(key, timeout, version)
+
+    @_timed
+    def incr(self, key, delta=1, version=None):
+        return super().incr(key, delta, version)
+
+    @_timed
+    def has_key(self, key, version=None):
+        return super().has_key(key, version)
+
+    @_timed
+    def delete(self, key, version=None):
+        return super().delete(key, version)
+
+    @_timed
+    def delete_many(self, keys, version=None):
+        return super().delete_many(keys, version)
+
+
+class TieredCache(BaseCache):
+    """
+    LRU в памяти процесса (L1) перед общим кешем (L2).
+
+    ``OPTIONS``:
+
+    * ``L2`` - настройки общего кеша, как в ``CACHES``;
+    * ``L1_MAX_BYTES`` - объём L1 (по размеру pickle значений);
+    * ``L1_MAX_ITEM_BYTES`` - значения крупнее в L1 не попадают;
+    * ``L1_TIMEOUT`` - сколько секунд значение живёт в L1;
+    * ``STAMP_INTERVAL`` - как часто сверять штамп L1 с L2;
+    * ``L2_ONLY_PREFIXES`` - ключи-счётчики, которые читаются только из L2
+      (по умолчанию версии ``shopapp.versions``).
+
+    Согласованность между процессами: счётчики версий в L1 не попадают,
+    поэтому ``incr`` виден всем процессам сразу, а ключи с данными
+    версионные - после изменения версии старые записи просто перестают
+    читаться и вытесняются из L1 сами. ``set``/``add``/``delete`` других
+    процессов видны не позже чем через ``L1_TIMEOUT``. Только ``clear``
+    поднимает штамп в L2: процесс, увидевший новый штамп, очищает свой L1
+    не позже чем через ``STAMP_INTERVAL``.
+    """
+
+    stamp_key = "tiered_cache:stamp"
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        l2 = dict(options["L2"])
+        backend = import_string(l2.pop("BACKEND"))
+        self._l2 = backend(l2.pop("LOCATION", ""), l2)
+
+        self.l1_max_bytes = int(options.get("L1_MAX_BYTES", 16 * 1024 * 1024))
+        self.l1_max_item_bytes = int(options.get("L1_MAX_ITEM_BYTES", self.l1_max_bytes // 16))
+        self.l1_timeout = float(options.get("L1_TIMEOUT", 5))
+        self.stamp_interval = float(options.get("STAMP_INTERVAL", 0.5))
+        self.l2_only_prefixes = tuple(options.get("L2_ONLY_PREFIXES", ("model_version:",)))
+
+        self._l1 = OrderedDict()  # ключ L2 -> (истекает, размер, pickle)
+        self._l1_bytes = 0
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._stamp_checked_at = 0.0
+        self._counters = dict.fromkeys(
+            ("l1_hits", "l1_misses", "l2_hits", "l2_misses",
+             "evictions", "expirations", "invalidations"),
+            0,
+        )
+
+    # L1
+
+    def _check_stamp(self):
+        now = monotonic()
+        if now - self._stamp_checked_at < self.stamp_interval:
+            return
+        stamp = self._l2.get(self.stamp_key)
+        if stamp is None:
+            self._l2.add(self.stamp_key, time_ns(), timeout=None)
+            stamp = self._l2.get(self.stamp_key)
+        with self._lock:
+            if stamp != self._stamp:
+                if self._stamp is not None:
+                    self._counters["invalidations"] += 1
+                self._clear_l1()
+                self._stamp = stamp
+            self._stamp_checked_at = now
+
+    def _bump_stamp(self):
+        try:
+            stamp = self._l2.incr(self.stamp_key)
+        except ValueError:
+            self._l2.add(self.stamp_key, time_ns(), timeout=None)
+            stamp = self._l2.get(self.stamp_key)
+        with self._lock:
+            self._clear_l1()
+            self._stamp = stamp
+            self._stamp_checked_at = monotonic()
+
+    def _l2_only(self, key) -> bool:
+        return isinstance(key, str) and key.startswith(self.l2_only_prefixes)
+
+    def _clear_l1(self):
+        self._l1.clear()
+        self._l1_bytes = 0
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                self._counters["l1_misses"] += 1
+                return _MISSING
+            expires, _, data = entry
+            if expires <= monotonic():
+                self._l1_pop(key)
+                self._counters["expirations"] += 1
+                self._counters["l1_misses"] += 1
+                return _MISSING
+            self._l1.move_to_end(key)
+            self._counters["l1_hits"] += 1
+        return pickle.loads(data)
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self._l2.default_timeout
+        ttl = self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+        if ttl <= 0:
+            self._l1_delete(key)
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.l1_max_item_bytes:
+            self._l1_delete(key)
+            return
+        with self._lock:
+            self._l1_pop(key)
+            self._l1[key] = (monotonic() + ttl, len(data), data)
+            self._l1_bytes += len(data)
+            while self._l1_bytes > self.l1_max_bytes:
+                self._l1_pop(next(iter(self._l1)))
+                self._counters["evictions"] += 1
+
+    def _l1_pop(self, key):
+        entry = self._l1.pop(key, None)
+        if entry is not None:
+            self._l1_bytes -= entry[1]
+
+    def _l1_delete(self, key):
+        with self._lock:
+            self._l1_pop(key)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def stats(self) -> dict:
+        """Счётчики L1 этого процесса - для подбора ``L1_MAX_BYTES``."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["entries"] = len(self._l1)
+            stats["bytes"] = self._l1_bytes
+        lookups = stats["l1_hits"] + stats["l1_misses"]
+        stats["l1_hit_rate"] = round(stats["l1_hits"] / lookups, 4) if lookups else None
+        stats["max_bytes"] = self.l1_max_bytes
+        stats["pid"] = os.getpid()
+        return stats
+
+    # API кеша; ключи строит L2, они же ключи L1
+
+    def make_and_validate_key(self, key, version=None):
+        return self._l2.make_and_validate_key(key, version)
+
+    def get(self, key, default=None, version=None):
+        if self._l2_only(key):
+            return self._l2.get(key, default, version)
+        self._check_stamp()
+        l1_key = self.make_and_validate_key(key, version)
+        value = self._l1_get(l1_key)
+        if value is not _MISSING:
+            return value
+        value = self._l2.get(key, _MISSING, version)
+        if value is _MISSING:
+            self._count("l2_misses")
+            return default
+        self._count("l2_hits")
+        self._l1_set(l1_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._check_stamp()
+        found = {}
+        missing = []
+        for key in keys:
+            if self._l2_only(key):
+                missing.append(key)
+                continue
+            value = self._l1_get(self.make_and_validate_key(key, version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            from_l2 = self._l2.get_many(missing, version)
+            self._count("l2_hits", len(from_l2))
+            self._count("l2_misses", len(missing) - len(from_l2))
+            for key, value in from_l2.items():
+                if not self._l2_only(key):
+                    self._l1_set(self.make_and_validate_key(key, version), value)
+            found.update(from_l2)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l2.set(key, value, timeout, version)
+        if not self._l2_only(key):
+            self._l1_set(self.make_and_validate_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self._l2.set_many(data, timeout, version)
+        for key, value in data.items():
+            if key not in failed and not self._l2_only(key):
+                self._l1_set(self.make_and_validate_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # add служит блокировкой и инициализацией - решает только L2
+        added = self._l2.add(key, value, timeout, version)
+        if added:
+            self._l1_delete(self.make_and_validate_key(key, version))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version))
+        return self._l2.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version))
+        return self._l2.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self.make_and_validate_key(key, version))
+        self._l2.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self._l2.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        # счётчик из L2_ONLY_PREFIXES в L1 не попадает; чужие копии
+        # остальных ключей доживают до L1_TIMEOUT, как после set
+        self._l1_delete(self.make_and_validate_key(key, version))
+        return self._l2.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version))
+        return self._l2.decr(key, delta, version)
+
+    def clear(self):
+        self._l2.clear()
+        self._bump_stamp()
+
+    def close(self, **kwargs):
+        self._l2.close(**kwargs)
+
+
+class InstrumentedFileBasedCache(InstrumentedCacheMixin, FileBasedCache):
+    pass
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentedTieredCache(InstrumentedCacheMixin, TieredCache):
+    pass
@@ -0,0 +1,66 @@
+"""
+Запись в SQLite из нескольких процессов.
+
+Профиль ``DJANGO_SQLITE_PRODUCTION`` (см. settings) включает WAL
+и ``BEGIN IMMEDIATE``: транзакция берёт блокировку записи сразу и ждёт
+её ``busy_timeout``, а не падает с ``database is locked``, когда две
+читающие транзакции одновременно начинают писать. Если ожидание всё же
+истекло, ``atomic_retry`` повторяет транзакцию целиком с паузой.
+"""
+from functools import wraps
+from random import uniform
+from time import sleep
+import logging
+
+from django.db import OperationalError, transaction
+
+
+log = logging.getLogger(__name__)
+
+LOCK_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+
+
+def is_lock_error(exc: Exception) -> bool:
+    return isinstance(exc, OperationalError) and any(
+        message in str(exc) for message in LOCK_MESSAGES
+    )
+
+
+def atomic_retry(func=None, *, using=None, attempts: int = 5, backoff: float = 0.05,
+                 max_backoff: float = 1.0):
+    """
+    ``transaction.atomic``, который повторяется при блокировке базы.
+
+    Паузы между попытками растут экспоненциально (``backoff * 2**n``, не
+    больше ``max_backoff``) со случайным разбросом, чтобы ждущие писатели
+    не просыпались одновременно. Внутри уже открытой транзакции работает
+    как обычный ``atomic``: повторять можно только внешнюю транзакцию.
+    Функция должна быть безопасна для повторного вызова.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if transaction.get_connection(using).in_atomic_block:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+
+            for attempt in range(1, attempts + 1):
+                try:
+                    with transaction.atomic(using=using):
+                        return func(*args, **kwargs)
+                except OperationalError as exc:
+                    if attempt == attempts or not is_lock_error(exc):
+                        raise
+                    delay = uniform(0, min(max_backoff, backoff * 2 ** attempt))
+                    log.warning(
+                        "%s: %s, retry %s/%s in %.3fs",
+                        func.__qualname__, exc, attempt, attempts - 1, delay,
+                    )
+                    sleep(delay)
+
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,77 @@
+"""
+RSS-ленты, которые рендерятся один раз на изменение.
+
+``CachedFeed`` перед рендером делает один запрос - число строк
+и последнюю дату (``timestamp_field``) в ``get_queryset()``. По ним
+строится ключ кеша готового XML. ``ETag`` - хеш закешированного XML,
+``Last-Modified`` - время рендера, сохранённое вместе с ним: удаление
+строки не сдвигает последнюю дату, но меняет ключ, а с ним и время
+рендера. На ``If-None-Match`` и ``If-Modified-Since`` лента отвечает 304
+без обращения к строкам.
+
+Правка уже показанной строки не меняет ключ: лента обновится через
+``cache_timeout`` или при следующем добавлении.
+"""
+from hashlib import md5
+from time import time
+
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpRequest, HttpResponse
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class CachedFeed(Feed):
+    cache_timeout = 60 * 60
+    timestamp_field = None
+
+    def get_queryset(self):
+        """Строки ленты: от них зависит ключ кеша."""
+        raise NotImplementedError
+
+    def _cache_key(self, request: HttpRequest, state: dict) -> str:
+        latest = state["latest"].isoformat() if state["latest"] else ""
+        # ссылки в XML абсолютные и зависят от хоста и языка
+        source = "|".join((
+            request.scheme,
+            request.get_host(),
+            request.path,
+            translation.get_language() or "",
+            str(state["count"]),
+            latest,
+        ))
+        name = f"{type(self).__module__}.{type(self).__qualname__}"
+        return f"feed:{name}:{md5(source.encode()).hexdigest()}"
+
+    def _render(self, request: HttpRequest, *args, **kwargs) -> dict:
+        response = super().__call__(request, *args, **kwargs)
+        return {
+            "content": response.content,
+            "content_type": response["Content-Type"],
+            "etag": quote_etag(md5(response.content).hexdigest()),
+            "rendered_at": int(time()),
+        }
+
+    def __call__(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        state = self.get_queryset().aggregate(
+            count=Count("pk"),
+            latest=Max(self.timestamp_field),
+        )
+        key = self._cache_key(request, state)
+        rendered = cache.get(key)
+        if rendered is None:
+            rendered = self._render(request, *args, **kwargs)
+            cache.set(key, rendered, self.cache_timeout)
+
+        response = HttpResponse(rendered["content"], content_type=rendered["content_type"])
+        response.headers["ETag"] = rendered["etag"]
+        response.headers["Last-Modified"] = http_date(rendered["rendered_at"])
+        return get_conditional_response(
+            request,
+            etag=rendered["etag"],
+            last_modified=rendered["rendered_at"],
+            response=response,
+        )
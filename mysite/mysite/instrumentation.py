@@ -0,0 +1,212 @@
+"""
+Замер времени запроса: SQL, кеш и рендеринг шаблонов.
+
+``RequestTimingMiddleware`` на время запроса кладёт ``RequestMetrics``
+в contextvar. В него пишут:
+
+* обёртка ``connection.execute_wrappers`` - число и время SQL-запросов;
+* бэкенды кеша из ``mysite.cache`` - попадания, промахи и время;
+* бэкенд шаблонов ``InstrumentedDjangoTemplates`` - время рендеринга.
+
+Итог отдаётся заголовком ``Server-Timing`` и, если запрос дольше
+``SLOW_REQUEST_MS``, пишется в лог ``mysite.slow_requests``.
+Вне запроса (команды, воркеры) contextvar пуст и замеры не делаются.
+
+Интервалы вложены друг в друга (SQL внутри шаблона, кеш внутри
+представления), поэтому их сумма может быть больше ``total``.
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from time import perf_counter
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+slow_log = logging.getLogger("mysite.slow_requests")
+
+
+@dataclass
+class RequestMetrics:
+    sql_count: int = 0
+    sql_ms: float = 0.0
+    cache_calls: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cache_ms: float = 0.0
+    template_ms: float = 0.0
+    # вложенные вызовы (get_many -> get, include через render_to_string)
+    # не считаем дважды
+    cache_depth: int = 0
+    template_depth: int = 0
+
+    def as_dict(self) -> dict:
+        data = asdict(self)
+        del data["cache_depth"], data["template_depth"]
+        for key in ("sql_ms", "cache_ms", "template_ms"):
+            data[key] = round(data[key], 2)
+        return data
+
+
+_metrics: ContextVar = ContextVar("request_metrics", default=None)
+
+
+def current_metrics():
+    """``RequestMetrics`` текущего запроса или None."""
+    return _metrics.get()
+
+
+def _time_sql(execute, sql, params, many, context):
+    metrics = _metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.sql_count += 1
+        metrics.sql_ms += (perf_counter() - started) * 1000
+
+
+def install_sql_timer(connection, **kwargs):
+    """
+    Подключает замер SQL к соединению.
+
+    Обёртка стоит на соединении постоянно и берёт метрики из contextvar:
+    async-представления выполняют запросы в потоках ``sync_to_async``,
+    где свои соединения, а contextvar туда копируется.
+    """
+    if _time_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_sql)
+
+
+connection_created.connect(install_sql_timer)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _metrics.get()
+        if metrics is None or metrics.template_depth:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            metrics.template_ms += (perf_counter() - started) * 1000
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Шаблонизатор Django, который замеряет время рендеринга."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class RequestTimingMiddleware:
+    """
+    Собирает метрики запроса, добавляет ``Server-Timing`` и пишет медленные
+    запросы в лог.
+
+    Отключается настройкой ``REQUEST_TIMING = False``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_TIMING", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # соединения, открытые до загрузки middleware
+        for connection in connections.all(initialized_only=True):
+            install_sql_timer(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def finish(self, request, response, metrics: RequestMetrics, started: float):
+        total_ms = (perf_counter() - started) * 1000
+        response["Server-Timing"] = self.server_timing(metrics, total_ms)
+        threshold = getattr(settings, "SLOW_REQUEST_MS", None)
+        if threshold is not None and total_ms >= threshold:
+            self.log_slow_request(request, response, metrics, total_ms)
+        return response
+
+    @staticmethod
+    def server_timing(metrics: RequestMetrics, total_ms: float) -> str:
+        return ", ".join([
+            f'sql;dur={metrics.sql_ms:.1f};desc="{metrics.sql_count} queries"',
+            f'cache;dur={metrics.cache_ms:.1f};'
+            f'desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+            f"tpl;dur={metrics.template_ms:.1f}",
+            f"total;dur={total_ms:.1f}",
+        ])
+
+    @staticmethod
+    def view_name(request) -> str:
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return "-"
+        return match.view_name or match._func_path
+
+    def log_slow_request(self, request, response, metrics, total_ms):
+        view = self.view_name(request)
+        data = metrics.as_dict()
+        slow_log.warning(
+            "Slow request view=%s method=%s path=%s status=%s total_ms=%.1f "
+            "sql=%s/%.1fms cache=%s hits %s misses/%.1fms template_ms=%.1f",
+            view,
+            request.method,
+            request.path,
+            response.status_code,
+            total_ms,
+            metrics.sql_count,
+            metrics.sql_ms,
+            metrics.cache_hits,
+            metrics.cache_misses,
+            metrics.cache_ms,
+            metrics.template_ms,
+            extra={
+                "view": view,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "total_ms": round(total_ms, 2),
+                **data,
+            },
+        )
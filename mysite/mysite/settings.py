@@ -13,6 +13,7 @@ from os import getenv
 from pathlib import Path
 import logging.config
 
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse_lazy
 import sentry_sdk
 
@@ -25,7 +26,7 @@ from django.utils.translation import gettext_lazy as _
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATABASE_DIR = BASE_DIR / "database"
+DATABASE_DIR = Path(getenv("DJANGO_DATABASE_DIR", BASE_DIR / "database"))
 DATABASE_DIR.mkdir(exist_ok=True)
 
 
@@ -85,6 +86,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'mysite.instrumentation.RequestTimingMiddleware',
     # 'django.middleware.cache.UpdateCacheMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -104,7 +106,7 @@ ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'mysite.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -131,11 +133,51 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile for several workers on one database file:
+# WAL (readers do not block the writer), fsync only at checkpoints,
+# BEGIN IMMEDIATE for atomic blocks (no lock upgrade deadlocks),
+# bigger page cache and mmap, persistent connections.
+# Under ASGI (DJANGO_ASGI=1, uvicorn workers) every sync_to_async thread
+# keeps its own persistent connection: open file handles and WAL readers
+# that hold back checkpoints pile up, so connections are closed after
+# each request there (CONN_MAX_AGE=0).
+SQLITE_PRODUCTION = getenv("DJANGO_SQLITE_PRODUCTION", "0") == "1"
+ASGI = getenv("DJANGO_ASGI", "0") == "1"
+SQLITE_PRODUCTION_OPTIONS = {
+    "transaction_mode": "IMMEDIATE",
+    "init_command": (
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA busy_timeout=5000;"
+        "PRAGMA cache_size=-20000;"
+        "PRAGMA mmap_size=134217728;"
+        "PRAGMA temp_store=MEMORY;"
+    ),
+}
+
+if SQLITE_PRODUCTION:
+    if ASGI and int(getenv("DJANGO_CONN_MAX_AGE", "0")):
+        raise ImproperlyConfigured("DJANGO_CONN_MAX_AGE must be 0 with DJANGO_ASGI=1")
+    DATABASES['default'].update({
+        'OPTIONS': SQLITE_PRODUCTION_OPTIONS,
+        'CONN_MAX_AGE': 0 if ASGI else int(getenv("DJANGO_CONN_MAX_AGE", "600")),
+        'CONN_HEALTH_CHECKS': not ASGI,
+    })
+
 CACHES = {
     'default': {
         # 'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '/var/tmp/django_cache',
+        # in-process LRU (L1) in front of the shared file cache (L2),
+        # L1 counters are at /cache-stats/
+        'BACKEND': 'mysite.cache.InstrumentedTieredCache',
+        'OPTIONS': {
+            'L2': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': '/var/tmp/django_cache',
+            },
+            'L1_MAX_BYTES': int(getenv("DJANGO_CACHE_L1_MAX_BYTES", 16 * 1024 * 1024)),
+            'L1_TIMEOUT': 5,
+        },
     }
 }
 
@@ -192,6 +234,10 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
+
+# Sitemap files written by `manage.py build_sitemaps`, served at /sitemap.xml
+SITEMAP_ROOT = Path(getenv("DJANGO_SITEMAP_ROOT", BASE_DIR / "sitemaps"))
+SITEMAP_BASE_URL = getenv("DJANGO_SITEMAP_BASE_URL", "http://localhost:8000")
 # DEFAULT_FILE_STORAGE =
 
 # Default primary key field type
@@ -233,6 +279,26 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+# CSV imports run in a thread pool of the web process;
+# set to 0 and run `manage.py import_worker` to process them separately
+IMPORT_JOBS_IN_PROCESS = getenv("DJANGO_IMPORT_JOBS_IN_PROCESS", "1") == "1"
+IMPORT_JOB_WORKERS = int(getenv("DJANGO_IMPORT_JOB_WORKERS", "2"))
+# running jobs without progress for this many seconds are marked failed
+IMPORT_JOB_STALE_AFTER = int(getenv("DJANGO_IMPORT_JOB_STALE_AFTER", 15 * 60))
+
+# Resized copies (and WebP) of uploaded images, built in a process pool;
+# set DJANGO_IMAGE_VARIANTS_ASYNC=0 to build them in the saving process
+IMAGE_VARIANT_WIDTHS = [160, 320, 640]
+IMAGE_VARIANT_WORKERS = int(getenv("DJANGO_IMAGE_VARIANT_WORKERS", "2"))
+IMAGE_VARIANTS_ASYNC = getenv("DJANGO_IMAGE_VARIANTS_ASYNC", "1") == "1"
+# Threads that validate and store files of one bulk image upload
+IMAGE_UPLOAD_WORKERS = int(getenv("DJANGO_IMAGE_UPLOAD_WORKERS", "8"))
+
+# Server-Timing header with SQL/cache/template timings on every response;
+# requests slower than SLOW_REQUEST_MS are logged to "mysite.slow_requests"
+REQUEST_TIMING = getenv("DJANGO_REQUEST_TIMING", "1") == "1"
+SLOW_REQUEST_MS = int(getenv("DJANGO_SLOW_REQUEST_MS", "500"))
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "My Site Project API",
     "DESCRIPTION": "My site with shop app and custom auth",
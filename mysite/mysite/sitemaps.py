@@ -1,7 +1,171 @@
+"""
+Карта сайта, заранее собранная в файлы.
+
+Каждая секция (``sitemaps``) делится на части по диапазонам первичного
+ключа: часть ``n`` содержит строки с ``pk`` от ``n * limit`` до
+``(n + 1) * limit - 1``, так что в файле не больше ``limit`` (50 000)
+адресов, а удаление строки не сдвигает соседние части. Файлы
+``sitemap-<секция>-<n>.xml`` и индекс ``sitemap.xml`` пишет команда
+``build_sitemaps`` в ``SITEMAP_ROOT``, представление ``sitemap_file``
+только отдаёт их с ``ETag`` и ``Last-Modified``.
+
+Для каждой части одним запросом с ``GROUP BY`` считается отпечаток:
+число строк, сумма ``pk`` и последняя дата изменения. Он хранится
+в ``manifest.json``, и при следующей сборке перезаписываются только
+части с другим отпечатком.
+"""
+from pathlib import Path
+from xml.sax.saxutils import escape
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Sum
+from django.urls import reverse
+from django.utils import translation
+
 from blogapp.sitemap import BlogSitemap
 from shopapp.sitemap import ShopSitemap
 
 sitemaps = {
     "blog": BlogSitemap,
     "shop": ShopSitemap,
-}
\ No newline at end of file
+}
+
+INDEX_NAME = "sitemap.xml"
+MANIFEST_NAME = "manifest.json"
+XMLNS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+_SENTINEL_PK = 9_876_543_210_123
+
+
+def section_file_name(section: str, shard: int) -> str:
+    return f"sitemap-{section}-{shard}.xml"
+
+
+def _format_date(value) -> str | None:
+    return value.isoformat() if value is not None else None
+
+
+def _write_atomic(path: Path, chunks) -> None:
+    # читатели видят либо старый файл, либо новый целиком
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.writelines(chunks)
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def _read_manifest(root: Path) -> dict:
+    try:
+        with open(root / MANIFEST_NAME, encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def shard_fingerprints(sitemap) -> dict[int, list]:
+    """``{номер части: [строк, сумма pk, последнее изменение]}``."""
+    shard = ExpressionWrapper(F("pk") / sitemap.limit, output_field=IntegerField())
+    rows = (
+        sitemap.items()
+        .order_by()
+        .annotate(shard=shard)
+        .values("shard")
+        .annotate(urls=Count("pk"), pk_sum=Sum("pk"), lastmod=Max(sitemap.lastmod_field))
+    )
+    return {
+        row["shard"]: [row["urls"], row["pk_sum"], _format_date(row["lastmod"])]
+        for row in rows
+    }
+
+
+def _location_func(sitemap):
+    url_name = getattr(sitemap, "url_name", None)
+    if url_name is None:
+        return sitemap.location
+    # reverse() на каждую строку - больше половины времени сборки,
+    # поэтому адрес строится один раз и в него подставляется pk
+    prefix, suffix = reverse(url_name, kwargs={"pk": _SENTINEL_PK}).split(str(_SENTINEL_PK))
+    return lambda item: f"{prefix}{item.pk}{suffix}"
+
+
+def _iter_urlset(sitemap, shard: int, base_url: str):
+    location = _location_func(sitemap)
+    items = (
+        sitemap.items()
+        .filter(pk__gte=shard * sitemap.limit, pk__lt=(shard + 1) * sitemap.limit)
+        .iterator(chunk_size=2000)
+    )
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS}">\n'
+    for item in items:
+        parts = [f"<url><loc>{escape(base_url + location(item))}</loc>"]
+        lastmod = sitemap.lastmod(item)
+        if lastmod is not None:
+            parts.append(f"<lastmod>{_format_date(lastmod)}</lastmod>")
+        parts.append(f"<changefreq>{sitemap.changefreq}</changefreq>")
+        parts.append(f"<priority>{sitemap.priority}</priority></url>\n")
+        yield "".join(parts)
+    yield "</urlset>\n"
+
+
+def _iter_index(shards: dict, base_url: str):
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{XMLNS}">\n'
+    for section, section_shards in sorted(shards.items()):
+        for shard, fingerprint in sorted(section_shards.items(), key=lambda item: int(item[0])):
+            location = f"{base_url}/{section_file_name(section, int(shard))}"
+            yield f"<sitemap><loc>{escape(location)}</loc>"
+            if fingerprint[2] is not None:
+                yield f"<lastmod>{fingerprint[2]}</lastmod>"
+            yield "</sitemap>\n"
+    yield "</sitemapindex>\n"
+
+
+def build_sitemaps(root=None, base_url=None, force: bool = False) -> dict:
+    """
+    Перезаписывает изменившиеся части карты сайта и индекс.
+
+    Возвращает ``{"written": [...], "unchanged": n, "removed": [...]}``.
+    """
+    root = Path(root or settings.SITEMAP_ROOT)
+    base_url = (base_url or settings.SITEMAP_BASE_URL).rstrip("/")
+    language = settings.LANGUAGES[0][0]
+    root.mkdir(parents=True, exist_ok=True)
+
+    manifest = _read_manifest(root)
+    if manifest.get("base_url") != base_url or manifest.get("language") != language:
+        force = True
+    previous = manifest.get("shards", {})
+
+    shards = {}
+    written, removed, unchanged = [], [], 0
+    with translation.override(language):
+        for section, sitemap_class in sitemaps.items():
+            sitemap = sitemap_class()
+            old = previous.get(section, {})
+            # ключи JSON - строки
+            current = {str(shard): value for shard, value in shard_fingerprints(sitemap).items()}
+            for shard, fingerprint in current.items():
+                path = root / section_file_name(section, int(shard))
+                if not force and old.get(shard) == fingerprint and path.exists():
+                    unchanged += 1
+                    continue
+                _write_atomic(path, _iter_urlset(sitemap, int(shard), base_url))
+                written.append(path.name)
+            for shard in old.keys() - current.keys():
+                path = root / section_file_name(section, int(shard))
+                path.unlink(missing_ok=True)
+                removed.append(path.name)
+            shards[section] = current
+
+    if written or removed or not (root / INDEX_NAME).exists():
+        _write_atomic(root / INDEX_NAME, _iter_index(shards, base_url))
+    _write_atomic(
+        root / MANIFEST_NAME,
+        [json.dumps({"base_url": base_url, "language": language, "shards": shards})],
+    )
+    return {"written": written, "unchanged": unchanged, "removed": removed}
@@ -17,15 +17,14 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
-from django.urls import path, include
+from django.urls import path, include, re_path
 
 from django.conf.urls.i18n import i18n_patterns
 
 from drf_spectacular.views import SpectacularAPIView, \
     SpectacularRedocView, SpectacularSwaggerView
 
-from .sitemaps import sitemaps
+from .views import cache_stats, sitemap_file
 
 urlpatterns = [
     path('admin/doc/', include('django.contrib.admindocs.urls')),
@@ -34,12 +33,9 @@ urlpatterns = [
     path('api/schema/swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     path('api/', include('myapiapp.urls')),
-    path(
-        'sitemap.xml',
-        sitemap,
-        {"sitemaps":sitemaps},
-        name="django.contrib.sitemaps.views.sitemap",
-    ),
+    path('cache-stats/', cache_stats, name='cache-stats'),
+    path('sitemap.xml', sitemap_file, {"name": "sitemap.xml"}, name='sitemap'),
+    re_path(r'^(?P<name>sitemap-[a-z]+-\d+\.xml)$', sitemap_file, name='sitemap-section'),
 ]
 
 urlpatterns +=i18n_patterns(
@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.http import FileResponse, Http404, HttpRequest, JsonResponse
+from django.views.decorators.http import condition, require_safe
+
+from .cache import TieredCache
+
+
+@staff_member_required
+def cache_stats(request: HttpRequest) -> JsonResponse:
+    """Счётчики L1 двухуровневых кешей в процессе, обработавшем запрос."""
+    stats = {
+        alias: caches[alias].stats()
+        for alias in caches.settings
+        if isinstance(caches[alias], TieredCache)
+    }
+    return JsonResponse(stats)
+
+
+def _sitemap_stat(name: str) -> os.stat_result | None:
+    try:
+        return os.stat(settings.SITEMAP_ROOT / name)
+    except OSError:
+        return None
+
+
+def _sitemap_etag(request: HttpRequest, name: str) -> str | None:
+    stat = _sitemap_stat(name)
+    if stat is None:
+        return None
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _sitemap_last_modified(request: HttpRequest, name: str) -> datetime | None:
+    stat = _sitemap_stat(name)
+    if stat is None:
+        return None
+    return datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+
+
+@require_safe
+@condition(etag_func=_sitemap_etag, last_modified_func=_sitemap_last_modified)
+def sitemap_file(request: HttpRequest, name: str) -> FileResponse:
+    """Файл карты сайта, собранный командой ``build_sitemaps``."""
+    try:
+        file = open(settings.SITEMAP_ROOT / name, "rb")
+    except OSError:
+        raise Http404("Sitemap is not built yet")
+    return FileResponse(file, content_type="application/xml")
@@ -4,14 +4,19 @@ from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render, redirect
 from django.urls import path
 
-from .common import save_csv_model
+from .jobs import create_import_job
 from .forms import CSVImportForm
-from .models import Product, Order, ProductImage
-from .admin_mixins import ExportAsCSVMixin
+from .models import Product, Order, ProductImage, ImportJob
+from .search import search_available, search_products
+from .admin_mixins import ExportAsCSVMixin, HighVolumeAdminMixin, \
+    LimitedInlineFormSet
 
 
 class OrderInline(admin.TabularInline):
     model = Product.orders.through
+    # у популярного товара могут быть миллионы заказов
+    raw_id_fields = "order",
+    formset = LimitedInlineFormSet
 
 
 class ProductInline(admin.StackedInline):
@@ -29,20 +34,22 @@ def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(HighVolumeAdminMixin, admin.ModelAdmin, ExportAsCSVMixin):
     model = Product
     change_list_template = "shopapp/products_changelist.html"
     actions = [
         mark_archived,
         mark_unarchived,
-        "export_csv",
+        "export_as_csv",
     ]
+    export_csv_related = {"created_by": "username"}
     inlines = [
         OrderInline,
         ProductInline,
     ]
     # list_display = "pk", "name", "description", "price", "discount"
     list_display = "pk", "name", "description_short", "price", "discount", "archived"
+    truncated_columns = {"description_short": ("description", 48)}
     list_display_links = "pk", "name"
     ordering = "-name", "pk"
     search_fields = "name", "description"
@@ -64,10 +71,15 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         })
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        if search_term and search_available(queryset.db):
+            return search_products(queryset, search_term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    @admin.display(description="description")
     def description_short(self, obj: Product) -> str:
-        if len(obj.description) < 48:
-            return obj.description
-        return obj.description[:48] + "..."
+        # обрезается в базе, см. truncated_columns
+        return obj.description_short
 
     def import_csv(self, request: HttpRequest) -> HttpResponse:
         if request.method == "GET":
@@ -85,13 +97,14 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_model(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding or "utf-8",
+        job = create_import_job(
+            form.files["csv_file"],
             model=self.model,
+            encoding=request.encoding,
+            user=request.user,
         )
 
-        self.message_user(request, "Data from CSV was imported")
+        self.message_user(request, f"Import job #{job.pk} was queued")
         return redirect("..")
 
 
@@ -109,19 +122,24 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 
 class ProductInline(admin.StackedInline):
     model = Order.products.through
+    raw_id_fields = "product",
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(HighVolumeAdminMixin, admin.ModelAdmin, ExportAsCSVMixin):
     model = Order
     change_list_template = "shopapp/orders_changelist.html"
+    actions = [
+        "export_as_csv",
+    ]
+    export_csv_related = {"user": "username"}
     inlines = [
         ProductInline,
     ]
-    list_display = "delivery_address", "promocode", "created_at", "user_verbose"
-
-    def get_queryset(self, request):
-        return Order.objects.select_related("user").prefetch_related("products")
+    list_display = "delivery_address", "promocode", "created_at", "user_verbose", \
+        "total", "products_count"
+    list_select_related = "user",
+    list_columns = "user__first_name", "user__username"
 
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
@@ -142,13 +160,14 @@ class OrderAdmin(admin.ModelAdmin):
             }
             return render(request, "admin/csv_form.html", context, status=400)
 
-        save_csv_model(
-            file=form.files["csv_file"].file,
-            encoding=request.encoding or "utf-8",
+        job = create_import_job(
+            form.files["csv_file"],
             model=self.model,
+            encoding=request.encoding,
+            user=request.user,
         )
 
-        self.message_user(request, "Data from CSV was imported")
+        self.message_user(request, f"Import job #{job.pk} was queued")
         return redirect("..")
 
 
@@ -162,3 +181,12 @@ class OrderAdmin(admin.ModelAdmin):
             )
         ]
         return new_urls + urls
+
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = "pk", "model_label", "status", "rows_done", "rows_failed", \
+        "rows_per_sec", "created_at", "finished_at"
+    list_filter = "status", "model_label"
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
@@ -1,23 +1,235 @@
-import csv
-
-from django.db.models import QuerySet
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import Case, Max, Min, QuerySet, TextField, Value, When
+from django.db.models.functions import Concat, Length, Substr
+from django.db.models.lookups import GreaterThanOrEqual
 from django.db.models.options import Options
-from django.http import HttpRequest, HttpResponse
+from django.forms.models import BaseInlineFormSet
+from django.http import HttpRequest, StreamingHttpResponse
+from django.utils.functional import cached_property
+
+from .exports import stream_csv_response
 
 
 class ExportAsCSVMixin:
-    def export_as_csv(self, request: HttpRequest, queryset: QuerySet):
+    """
+    Действие админки "Export as CSV" для любой модели.
+
+    Файл отдаётся потоком, строки читаются кусками одним запросом через
+    ``values_list``. Внешние ключи выгружаются как id, а для полей из
+    ``export_csv_related`` - значением связанной модели через join,
+    например ``{"user": "username"}``.
+    """
+
+    export_csv_fields = None
+    export_csv_related = {}
+
+    def get_export_csv_columns(self):
+        """Пары (заголовок, выражение для ``values_list``)."""
         meta: Options = self.model._meta
-        field_names = [field.name for field in meta.fields]
+        names = self.export_csv_fields or [field.name for field in meta.concrete_fields]
+        columns = []
+        for name in names:
+            field = meta.get_field(name)
+            if name in self.export_csv_related:
+                columns.append((name, f"{name}__{self.export_csv_related[name]}"))
+            elif field.is_relation:
+                columns.append((field.attname, field.attname))
+            else:
+                columns.append((name, name))
+        return columns
+
+    @admin.action(description="Export as CSV")
+    def export_as_csv(self, request: HttpRequest, queryset: QuerySet) -> StreamingHttpResponse:
+        header, columns = zip(*self.get_export_csv_columns())
+        return stream_csv_response(
+            queryset.prefetch_related(None),
+            header,
+            columns,
+            filename=f"{self.model._meta}-export.csv",
+        )
+
+
+def estimate_rows(queryset: QuerySet):
+    """
+    Приблизительное число строк таблицы без ``COUNT(*)``.
+
+    PostgreSQL - статистика планировщика, SQLite - разброс первичного
+    ключа (индекс, две операции). None, если оценить нельзя.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else None
+    if connection.vendor == "sqlite" and model._meta.pk.get_internal_type() in (
+        "AutoField", "BigAutoField", "SmallAutoField",
+    ):
+        bounds = model._default_manager.using(queryset.db).aggregate(
+            low=Min("pk"),
+            high=Max("pk"),
+        )
+        if bounds["high"] is None:
+            return 0
+        return bounds["high"] - bounds["low"] + 1
+    return None
+
+
+class CappedCount(int):
+    """Число строк, упёршееся в ``count_limit``: выводится как "10000+"."""
+
+    def __str__(self):
+        return f"{int(self)}+"
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для больших таблиц в админке.
+
+    Без фильтров число строк оценивается (``estimate_rows``), с фильтрами
+    считается точно, но не дальше ``count_limit`` строк (``CappedCount``).
+
+    Оценка и предел - не настоящее число строк, поэтому любая страница
+    читается как есть: пустая сводится к последней непустой (число строк
+    тогда считается точно), неполная задаёт точное число строк, а полная
+    на краю оценки добавляет следующую.
+    """
+
+    count_limit = 10_000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and not queryset.query.distinct:
+            estimate = estimate_rows(queryset)
+            if estimate is not None:
+                self.estimated = True
+                return estimate
+        count = queryset.order_by()[:self.count_limit].count()
+        if count < self.count_limit:
+            return count
+        self.estimated = True
+        return CappedCount(count)
+
+    def set_count(self, count):
+        self.count = count
+        for name in ("num_pages", "page_range"):
+            self.__dict__.pop(name, None)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.estimated or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.estimated:
+            return super().page(number)
+
+        bottom = (number - 1) * self.per_page
+        page = self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+        if number > 1 and not page.object_list:
+            self.set_count(self.object_list.order_by().count())
+            self.estimated = False
+            return super().page(self.num_pages)
+
+        rows = len(page.object_list)
+        if rows < self.per_page:
+            # неполная страница - последняя: число строк известно точно
+            self.set_count(bottom + rows)
+            self.estimated = False
+        elif bottom + rows >= self.count:
+            # полная страница на краю оценки: за ней может быть ещё одна
+            self.set_count(CappedCount(bottom + rows + 1))
+        return page
+
+
+class LeanChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        return self.model_admin.get_changelist_queryset(queryset)
+
+    def get_results(self, request):
+        super().get_results(request)
+        # EstimatedCountPaginator мог уточнить число строк и вернуть последнюю страницу
+        self.result_count = self.paginator.count
+        self.page_num = min(self.page_num, self.paginator.num_pages)
+        self.multi_page = self.result_count > self.list_per_page
+        self.can_show_all = self.result_count <= self.list_max_show_all
+
+
+class HighVolumeAdminMixin:
+    """
+    Режим админки для таблиц с миллионами строк.
+
+    * ``EstimatedCountPaginator`` и ``show_full_result_count = False`` -
+      без точных ``COUNT(*)`` по всей таблице;
+    * список читает только колонки из ``list_display`` и ``list_columns``
+      (поля связанных моделей для вычисляемых колонок);
+    * ``truncated_columns`` - длинный текст обрезается в базе:
+      ``{"description_short": ("description", 48)}`` добавляет аннотацию
+      ``description_short`` вместо чтения всего ``description``.
+    """
+
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    list_columns = ()
+    truncated_columns = {}
+
+    def get_changelist(self, request, **kwargs):
+        return LeanChangeList
+
+    def get_changelist_columns(self):
+        meta: Options = self.model._meta
+        columns = []
+        for name in self.list_display:
+            try:
+                field = meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                columns.append(name)
+        return columns + list(self.list_columns)
+
+    def get_changelist_queryset(self, queryset: QuerySet) -> QuerySet:
+        truncated = {
+            alias: Case(
+                When(
+                    GreaterThanOrEqual(Length(field), length),
+                    then=Concat(Substr(field, 1, length), Value("..."), output_field=TextField()),
+                ),
+                default=field,
+                output_field=TextField(),
+            )
+            for alias, (field, length) in self.truncated_columns.items()
+        }
+        return queryset.only(*self.get_changelist_columns()).annotate(**truncated)
+
 
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = f"attachment; filename={meta}-export.csv"
-        writer = csv.writer(response)
+class LimitedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline-формы только для последних ``max_rows`` связей.
 
-        writer.writerow(field_names)
-        for obj in queryset:
-            writer.writerow([getattr(obj, field) for field in field_names])
+    Страница изменения не рендерит все связи объекта (например, все заказы
+    популярного товара); остальные редактируются со стороны связанной модели.
+    """
 
-        return response
+    max_rows = 50
 
-    export_as_csv.short_description = "Export as CSV"
+    def get_queryset(self):
+        if not hasattr(self, "_limited_queryset"):
+            queryset = super().get_queryset().order_by("-pk")
+            self._limited_queryset = queryset[:self.max_rows]
+        return self._limited_queryset
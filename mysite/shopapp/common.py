@@ -1,23 +1,168 @@
 from csv import DictReader
+from dataclasses import dataclass
 from io import TextIOWrapper
+from itertools import islice
+from timeit import default_timer
+import logging
+import re
 
-from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db import DatabaseError
 
+from mysite.db import atomic_retry
 
-User = get_user_model()
-def save_csv_model(file, encoding, model):
+from .models import Order
+
+
+log = logging.getLogger(__name__)
+
+IMPORT_BATCH_SIZE = 1000
+
+# ошибки в данных куска, после которых импорт можно продолжить
+IMPORT_ERRORS = (
+    DatabaseError,
+    ObjectDoesNotExist,
+    ValidationError,
+    ValueError,
+    TypeError,
+)
+
+
+@dataclass
+class ImportResult:
+    rows: int
+    seconds: float
+    failed: int = 0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+        }
+
+
+def parse_ids(value: str) -> list[int]:
+    """Список id из ячейки CSV: ``"1 2 3"``, ``"1,2,3"`` или ``"1;2;3"``."""
+    return [int(item) for item in re.split(r"[\s,;|]+", value.strip()) if item]
+
+
+def save_csv_model(file, encoding, model, batch_size=IMPORT_BATCH_SIZE,
+                   progress=None, on_error=None) -> ImportResult:
+    """
+    Потоково импортирует CSV в модель ``model``.
+
+    Файл читается кусками по ``batch_size`` строк, каждый кусок сохраняется
+    в своей транзакции. Колонки с внешними ключами (например ``user``)
+    содержат id и проверяются одним ``in_bulk`` на кусок, колонки
+    many-to-many (например ``products``) - список id, связи пишутся
+    ``bulk_create`` в промежуточную таблицу.
+
+    ``progress(result)`` вызывается после каждого куска с текущим
+    ``ImportResult``. Если передан ``on_error(rows, exc)``, ошибочный кусок
+    откатывается, попадает в ``failed`` и импорт продолжается, иначе
+    ошибка пробрасывается дальше.
+    """
     csv_file = TextIOWrapper(
         file,
         encoding=encoding,
     )
-
     reader = DictReader(csv_file)
 
-    models = []
-    for row in reader:
-        if "user" in row:
-            row["user"] = User.objects.get(pk=int(row["user"]))
+    started = default_timer()
+    result = ImportResult(rows=0, seconds=0.0)
+    while batch := list(islice(reader, batch_size)):
+        try:
+            save_csv_batch(model, batch, batch_size=batch_size)
+        except IMPORT_ERRORS as exc:
+            if on_error is None:
+                raise
+            on_error(batch, exc)
+            result.failed += len(batch)
+        else:
+            result.rows += len(batch)
+        result.seconds = default_timer() - started
+        if progress is not None:
+            progress(result)
+
+    result.seconds = default_timer() - started
+    log.info(
+        "Imported %s %s rows (%s failed) in %.2fs (%.0f rows/s)",
+        result.rows, model._meta.label, result.failed,
+        result.seconds, result.rows_per_sec,
+    )
+    return result
+
+
+@atomic_retry
+def save_csv_batch(model, rows, batch_size=IMPORT_BATCH_SIZE):
+    meta = model._meta
+    columns = rows[0].keys()
+    fk_fields = [
+        field for field in meta.concrete_fields
+        if field.is_relation and field.name in columns
+    ]
+    m2m_fields = [field for field in meta.many_to_many if field.name in columns]
+
+    related_objects = {}
+    for field in fk_fields:
+        ids = {int(row[field.name]) for row in rows if row[field.name]}
+        found = field.related_model._default_manager.only("pk").in_bulk(ids)
+        missing = ids - found.keys()
+        if missing:
+            raise field.related_model.DoesNotExist(
+                f"{field.name}: ids {sorted(missing)} do not exist"
+            )
+        related_objects[field.name] = found
+
+    objs = []
+    links = []
+    for row in rows:
+        # копия: при повторе транзакции строки нужны нетронутыми
+        row = dict(row)
+        links.append({field.name: parse_ids(row.pop(field.name) or "") for field in m2m_fields})
+        for field in fk_fields:
+            value = row[field.name]
+            row[field.name] = related_objects[field.name][int(value)] if value else None
+        objs.append(model(**row))
 
-        models.append(model(**row))
-    model.objects.bulk_create(models)
-    return models
+    model._default_manager.bulk_create(objs, batch_size=batch_size)
+
+    for field in m2m_fields:
+        save_m2m_links(field, objs, [obj_links[field.name] for obj_links in links])
+
+    if model is Order and m2m_fields:
+        # связи записаны мимо m2m_changed, итоги заказов считаем сами
+        Order.objects.recompute_totals_for(obj.pk for obj in objs)
+
+
+def save_m2m_links(field, objs, ids_per_obj):
+    """Пишет связи many-to-many всех ``objs`` одним ``bulk_create``."""
+    target_ids = {pk for ids in ids_per_obj for pk in ids}
+    found = set(
+        field.related_model._default_manager
+        .filter(pk__in=target_ids)
+        .order_by()
+        .values_list("pk", flat=True)
+    )
+    missing = target_ids - found
+    if missing:
+        raise field.related_model.DoesNotExist(
+            f"{field.name}: ids {sorted(missing)} do not exist"
+        )
+
+    through = field.remote_field.through
+    source = f"{field.m2m_field_name()}_id"
+    target = f"{field.m2m_reverse_field_name()}_id"
+    through.objects.bulk_create(
+        [
+            through(**{source: obj.pk, target: pk})
+            for obj, ids in zip(objs, ids_per_obj)
+            for pk in dict.fromkeys(ids)
+        ]
+    )
@@ -0,0 +1,115 @@
+"""
+HTTP-валидаторы (``ETag``/``Last-Modified``) для REST API.
+
+Состояние списка - число строк и ``max(updated_at)`` отфильтрованного
+queryset, их считает один агрегатный запрос. Любое изменение строки
+поднимает ``updated_at`` (см. ``VersionedQuerySet``), удаление меняет
+число строк, поэтому по ним клиенту можно ответить 304, а готовый
+ответ - взять из кеша по ``ETag`` без сериализации страницы.
+``Last-Modified`` списка - время сборки ответа, сохранённое в кеше рядом
+с ним, а не ``max(updated_at)``: удаление строки эту дату не сдвигает,
+а ключ по ``ETag`` меняет.
+
+Keyset-страницы (``?pagination=cursor``) не считают ``COUNT(*)``: вместо
+числа строк в ``ETag`` входят версии ``count_versions``.
+"""
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .versions import versioned_key
+
+
+class ConditionalViewSetMixin:
+    """
+    ``list`` и ``retrieve`` с ``ETag``/``Last-Modified`` и ответом 304.
+
+    Ответы ``list`` кешируются по ``ETag`` на ``list_cache_timeout`` секунд.
+    """
+
+    updated_field = "updated_at"
+    list_cache_timeout = 10 * 60
+    # версии, которые меняются при добавлении и удалении строк (см. versions.py)
+    count_versions = ()
+
+    def get_etag(self, request, *state) -> str:
+        # представление зависит от адреса (хост, страница, фильтры) и формата
+        source = "|".join(map(str, (
+            request.build_absolute_uri(),
+            request.accepted_media_type,
+            *state,
+        )))
+        return quote_etag(md5(source.encode()).hexdigest())
+
+    @staticmethod
+    def set_validators(response, etag, last_modified):
+        response.headers["ETag"] = etag
+        if last_modified is not None:
+            response.headers["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+    def not_modified(self, request, etag, last_modified):
+        """304 (или 412) по заголовкам запроса; ``None``, если нужен полный ответ."""
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if response is not None:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def get_list_state(self, request, queryset) -> tuple:
+        """``(max(updated_at), ...)`` - от этого зависит ответ ``list``."""
+        use_keyset = getattr(self.paginator, "use_keyset", None)
+        if self.count_versions and use_keyset is not None and use_keyset(request):
+            # курсор обходится без COUNT(*): вместо числа строк - версии,
+            # а правки (и строки, вышедшие из фильтра) ловит max(updated_at)
+            # всей таблицы, который читается по индексу
+            latest = self.get_queryset().order_by().aggregate(
+                latest=Max(self.updated_field),
+            )["latest"]
+            return latest, versioned_key("rows", *self.count_versions)
+        state = queryset.order_by().aggregate(
+            count=Count("pk"),
+            latest=Max(self.updated_field),
+        )
+        return state["latest"], state["count"]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        latest, *state = self.get_list_state(request, queryset)
+        etag = self.get_etag(request, latest, *state)
+        key = f"api:{self.basename}:list-page:{etag}"
+        cached = cache.get(key)
+        rendered_at = cached["rendered_at"] if cached is not None else None
+        response = self.not_modified(request, etag, rendered_at)
+        if response is not None:
+            return response
+
+        if cached is None:
+            rendered_at = timezone.now()
+            response = super().list(request, *args, **kwargs)
+            cache.set(
+                key,
+                {"data": response.data, "rendered_at": rendered_at},
+                self.list_cache_timeout,
+            )
+        else:
+            response = Response(cached["data"])
+        return self.set_validators(response, etag, rendered_at)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        last_modified = getattr(instance, self.updated_field)
+        etag = self.get_etag(request, instance.pk, last_modified)
+        response = self.not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = Response(self.get_serializer(instance).data)
+        return self.set_validators(response, etag, last_modified)
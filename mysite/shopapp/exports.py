@@ -0,0 +1,181 @@
+"""
+Потоковая выгрузка данных магазина.
+
+Строки читаются из базы кусками через ``iterator()`` в виде кортежей,
+поэтому память не растёт вместе с количеством выгружаемых записей.
+"""
+from collections import defaultdict
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+
+from .models import Order, Product
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: вместо записи возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_csv_response(queryset: QuerySet, header, columns, filename: str,
+                        chunk_size: int = EXPORT_CHUNK_SIZE) -> StreamingHttpResponse:
+    """
+    Отдаёт queryset как CSV-файл, не собирая его целиком в памяти.
+
+    ``columns`` - выражения для ``values_list`` (можно с join, например
+    ``user__username``), ``header`` - заголовки колонок в файле.
+    """
+    rows = queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+    response = StreamingHttpResponse(
+        iter_csv(header, rows),
+        content_type="text/csv",
+    )
+    response["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+def iter_json_object(key, items, extra=None):
+    """
+    Кусками отдаёт JSON вида ``{"<key>": [...]}``.
+
+    ``extra`` - необязательный callable, который вызывается после того,
+    как все элементы отданы, и возвращает дополнительные ключи объекта.
+    """
+    yield "{%s: [" % json.dumps(key)
+    separator = ""
+    for item in items:
+        yield separator + json.dumps(item, cls=DjangoJSONEncoder)
+        separator = ", "
+    yield "]"
+    for name, value in (extra() if extra else {}).items():
+        yield ", %s: %s" % (json.dumps(name), json.dumps(value, cls=DjangoJSONEncoder))
+    yield "}"
+
+
+async def aiter_json_object(key, items, extra=None, buffer_size: int = 64 * 1024):
+    """
+    ``iter_json_object`` для асинхронного итератора ``items``.
+
+    Элементы отдаются пачками примерно по ``buffer_size`` символов: каждый
+    кусок ответа - это отдельная отправка ASGI-сервером и шаг цикла событий.
+    """
+    buffer = ["{%s: [" % json.dumps(key)]
+    size = 0
+    separator = ""
+    async for item in items:
+        part = separator + json.dumps(item, cls=DjangoJSONEncoder)
+        buffer.append(part)
+        size += len(part)
+        separator = ", "
+        if size >= buffer_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    buffer.append("]")
+    yield "".join(buffer)
+    for name, value in (extra() if extra else {}).items():
+        yield ", %s: %s" % (json.dumps(name), json.dumps(value, cls=DjangoJSONEncoder))
+    yield "}"
+
+
+def _orders_chunk(last_id: int, size: int) -> QuerySet:
+    return (
+        Order.objects
+        .filter(pk__gt=last_id)
+        .order_by("pk")
+        .values_list("pk", "delivery_address", "promocode", "user_id")[:size]
+    )
+
+
+def _orders_chunk_links(orders) -> QuerySet:
+    """Товары куска заказов одним запросом по диапазону id."""
+    through = Order.products.through
+    product_ordering = [f"product__{field}" for field in Product._meta.ordering]
+    return (
+        through.objects
+        .filter(order_id__gte=orders[0][0], order_id__lte=orders[-1][0])
+        .order_by("order_id", *product_ordering)
+        .values_list("order_id", "product_id")
+    )
+
+
+def _orders_chunk_rows(orders, links):
+    product_ids = defaultdict(list)
+    for order_id, product_id in links:
+        product_ids[order_id].append(product_id)
+
+    for pk, delivery_address, promocode, user_id in orders:
+        yield {
+            "id": pk,
+            "delivery_address": delivery_address,
+            "promocode": promocode,
+            "user_id": user_id,
+            "product_id": product_ids[pk],
+        }
+
+
+def iter_orders_export(since_id: int = 0, limit: int = None,
+                       chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Отдаёт заказы с ``id > since_id`` по возрастанию id.
+
+    На каждый кусок из ``chunk_size`` заказов уходит два запроса: сами заказы
+    и все их товары одним запросом к промежуточной таблице по диапазону id.
+    """
+    last_id = since_id
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        orders = list(_orders_chunk(last_id, size))
+        if not orders:
+            return
+
+        yield from _orders_chunk_rows(orders, _orders_chunk_links(orders))
+
+        last_id = orders[-1][0]
+        if remaining is not None:
+            remaining -= len(orders)
+        if len(orders) < size:
+            return
+
+
+async def aiter_orders_export(since_id: int = 0, limit: int = None,
+                              chunk_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Асинхронный ``iter_orders_export``.
+
+    Пока клиент читает кусок, следующий не запрашивается, а ожидание
+    медленного клиента не занимает поток воркера.
+    """
+    last_id = since_id
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(chunk_size, remaining)
+        orders = [order async for order in _orders_chunk(last_id, size)]
+        if not orders:
+            return
+
+        links = [link async for link in _orders_chunk_links(orders)]
+        for row in _orders_chunk_rows(orders, links):
+            yield row
+
+        last_id = orders[-1][0]
+        if remaining is not None:
+            remaining -= len(orders)
+        if len(orders) < size:
+            return
@@ -3,6 +3,7 @@ from django import forms
 from django.forms import ClearableFileInput
 
 from .models import Product
+from .uploads import validate_images
 
 
 class GroupForm(forms.ModelForm):
@@ -21,8 +22,17 @@ class MultipleClearableFileInput(ClearableFileInput):
             return files.getlist(name)
 
 
+class MultipleImageField(forms.ImageField):
+    """Несколько картинок одним полем; Pillow проверяет их параллельно."""
+
+    def clean(self, data, initial=None):
+        if not data:
+            return super().clean(None, initial) or []
+        return validate_images(data)
+
+
 class ProductForm(forms.ModelForm):
-    images = forms.ImageField(
+    images = MultipleImageField(
         required=False,
         widget=MultipleClearableFileInput(attrs={'multiple': True}),
         label='Product Images',
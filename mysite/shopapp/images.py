@@ -0,0 +1,275 @@
+"""
+Уменьшенные копии загруженных картинок.
+
+Для каждого изображения строятся варианты фиксированной ширины
+(``IMAGE_VARIANT_WIDTHS``) в исходном формате и в WebP и сохраняются
+рядом с оригиналом: ``preview/lamp.jpg`` -> ``preview/lamp.320w.jpg``,
+``preview/lamp.320w.webp``. Расширение - по формату, в котором вариант
+записан (``KEEP_FORMATS``), а не по имени оригинала: для ``lamp.gif``
+или PNG под именем ``lamp.jpg`` это ``lamp.320w.png``.
+
+Pillow работает в пуле процессов (``IMAGE_VARIANT_WORKERS``), загрузка
+и запись файлов - в основном процессе через storage поля: запись
+готовых вариантов и ``on_done`` выполняет пул потоков, а не служебный
+поток пула процессов. Поля подключаются ``watch_image_field``, шаблоны
+и API выводят ``srcset`` через ``variant_srcset`` (тег ``{% picture %}``,
+``ImageVariantsField``).
+
+Готовность вариантов и их формат хранятся в кеше (``variants_format``),
+чтобы список из N картинок не делал N обращений к storage.
+
+Модуль не импортирует модели: функции для пула должны загружаться
+в дочерних процессах без настройки Django.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import md5
+from io import BytesIO
+import logging
+import multiprocessing
+import posixpath
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+
+
+log = logging.getLogger(__name__)
+
+WEBP = "webp"
+# форматы, которые браузеры показывают без конвертации
+KEEP_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "png"}
+
+# (model, field_name, on_done) - поля, подключённые watch_image_field
+watched_fields = []
+
+# отрицательный ответ has_variants: варианты может построить другой процесс
+MISSING_VARIANTS_TIMEOUT = 5 * 60
+
+_pool = None
+_pool_lock = threading.Lock()
+_savers = None
+
+
+def create_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: fork многопоточного веб-процесса небезопасен
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(settings.IMAGE_VARIANT_WORKERS)
+        return _pool
+
+
+def get_savers() -> ThreadPoolExecutor:
+    """Потоки, которые записывают готовые варианты и вызывают ``on_done``."""
+    global _savers
+    with _pool_lock:
+        if _savers is None:
+            _savers = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                thread_name_prefix="image-variants",
+            )
+        return _savers
+
+
+def variant_name(name: str, width: int, extension: str) -> str:
+    stem, _ = posixpath.splitext(name)
+    return f"{stem}.{width}w.{extension}"
+
+
+def marker_name(name: str) -> str:
+    """Вариант, который записывается последним: есть он - готовы все."""
+    return variant_name(name, min(settings.IMAGE_VARIANT_WIDTHS), WEBP)
+
+
+def render_variants(data: bytes, widths, quality: int = 80) -> list:
+    """
+    Строит варианты картинки. Выполняется в пуле процессов.
+
+    Возвращает ``[(width, extension, bytes), ...]``; WebP наименьшей
+    ширины - последним. Картинки уже нужной ширины не увеличиваются.
+    """
+    from PIL import Image, ImageOps
+
+    variants = []
+    with Image.open(BytesIO(data)) as image:
+        extension = KEEP_FORMATS.get(image.format, "png")
+        image = ImageOps.exif_transpose(image)
+        for width in sorted(widths, reverse=True):
+            copy = image.copy()
+            copy.thumbnail((width, copy.height), Image.Resampling.LANCZOS)
+            for ext in dict.fromkeys((extension, WEBP)):
+                if ext == "jpg" and copy.mode not in ("RGB", "L"):
+                    copy = copy.convert("RGB")
+                buffer = BytesIO()
+                copy.save(
+                    buffer,
+                    format="JPEG" if ext == "jpg" else ext.upper(),
+                    quality=quality,
+                    optimize=True,
+                )
+                variants.append((width, ext, buffer.getvalue()))
+    return variants
+
+
+def save_variants(field_file, variants) -> None:
+    storage = field_file.storage
+    extension = WEBP
+    for width, ext, data in variants:
+        if ext != WEBP:
+            extension = ext
+        name = variant_name(field_file.name, width, ext)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(data))
+    mark_variants(field_file, extension)
+
+
+def _variants_key(name: str) -> str:
+    return f"image_variants:{md5(name.encode()).hexdigest()}"
+
+
+def mark_variants(field_file, extension) -> None:
+    """Запоминает формат готовых вариантов (``False`` - вариантов нет)."""
+    cache.set(
+        _variants_key(field_file.name),
+        extension,
+        None if extension else MISSING_VARIANTS_TIMEOUT,
+    )
+
+
+def find_variants_format(field_file):
+    """Формат готовых вариантов по файлам в storage, ``False`` - их нет."""
+    storage = field_file.storage
+    if not storage.exists(marker_name(field_file.name)):
+        return False
+    width = min(settings.IMAGE_VARIANT_WIDTHS)
+    for extension in dict.fromkeys(KEEP_FORMATS.values()):
+        if extension != WEBP and storage.exists(variant_name(field_file.name, width, extension)):
+            return extension
+    return WEBP
+
+
+def variants_format(field_file, cached: bool = True):
+    """
+    Расширение вариантов в исходном формате (``jpg``, ``png``, ``webp``)
+    или ``None``, если они не готовы; без ``cached`` - проверка в storage.
+    """
+    if not field_file:
+        return None
+    extension = cache.get(_variants_key(field_file.name)) if cached else None
+    # True - отметка без формата, записанная до того, как он хранился
+    if extension is None or extension is True:
+        extension = find_variants_format(field_file)
+        mark_variants(field_file, extension)
+    return extension or None
+
+
+def has_variants(field_file, cached: bool = True) -> bool:
+    """Готовы ли варианты; без ``cached`` - проверка в storage."""
+    return variants_format(field_file, cached) is not None
+
+
+def read_original(field_file) -> bytes:
+    with field_file.storage.open(field_file.name, "rb") as file:
+        return file.read()
+
+
+def build_variants(field_file, on_done=None, wait: bool = None):
+    """
+    Строит варианты для файла поля в пуле процессов.
+
+    ``on_done`` вызывается после записи вариантов. С ``wait`` (по умолчанию
+    ``not IMAGE_VARIANTS_ASYNC``) варианты строятся в текущем процессе.
+    """
+    widths = settings.IMAGE_VARIANT_WIDTHS
+    if wait is None:
+        wait = not settings.IMAGE_VARIANTS_ASYNC
+    data = read_original(field_file)
+
+    if wait:
+        save_variants(field_file, render_variants(data, widths))
+        if on_done:
+            on_done()
+        return None
+
+    def save(future):
+        close_old_connections()
+        try:
+            save_variants(field_file, future.result())
+            if on_done:
+                on_done()
+        except Exception:
+            log.exception("Image variants for %s failed", field_file.name)
+        finally:
+            close_old_connections()
+
+    future = get_pool().submit(render_variants, data, widths)
+    # колбэк выполняется в служебном потоке пула процессов: запись в storage
+    # и базу из него задерживала бы выдачу остальных результатов
+    future.add_done_callback(lambda future: get_savers().submit(save, future))
+    return future
+
+
+def variant_srcset(field_file, extension: str = None) -> str:
+    """``srcset`` из готовых вариантов; пустая строка, если их ещё нет."""
+    ready = variants_format(field_file)
+    if ready is None:
+        return ""
+    extension = extension or ready
+    storage = field_file.storage
+    return ", ".join(
+        f"{storage.url(variant_name(field_file.name, width, extension))} {width}w"
+        for width in sorted(settings.IMAGE_VARIANT_WIDTHS)
+    )
+
+
+def _queue_variants(instance, field_name, on_done):
+    field_file = getattr(instance, field_name)
+    if not field_file or has_variants(field_file):
+        return
+    callback = (lambda: on_done(instance)) if on_done else None
+    transaction.on_commit(lambda: build_variants(field_file, callback))
+
+
+def queue_variants(instances, field_name: str) -> None:
+    """
+    Варианты для объектов, сохранённых без ``post_save`` (``bulk_create``).
+
+    Поле должно быть подключено ``watch_image_field``.
+    """
+    for instance in instances:
+        for model, name, on_done in watched_fields:
+            if name == field_name and isinstance(instance, model):
+                _queue_variants(instance, field_name, on_done)
+                break
+
+
+def watch_image_field(model, field_name: str, on_done=None) -> None:
+    """
+    Строит варианты после сохранения объекта с новой картинкой.
+
+    ``on_done(instance)`` вызывается, когда варианты записаны - например,
+    чтобы сбросить закешированные фрагменты объекта.
+    """
+
+    def image_saved(sender, instance, **kwargs):
+        _queue_variants(instance, field_name, on_done)
+
+    if (model, field_name, on_done) not in watched_fields:
+        watched_fields.append((model, field_name, on_done))
+    post_save.connect(
+        image_saved,
+        sender=model,
+        weak=False,
+        dispatch_uid=f"image_variants:{model._meta.label}.{field_name}",
+    )
@@ -0,0 +1,179 @@
+"""
+Фоновые задачи импорта CSV.
+
+Загрузка сохраняется в ``ImportJob``, а импорт выполняется вне запроса:
+в пуле потоков этого процесса (``IMPORT_JOBS_IN_PROCESS``) или
+отдельной командой ``manage.py import_worker``. Файл загрузки удаляется,
+когда задача завершается.
+
+Выполняемая задача обновляет ``heartbeat_at`` после каждого куска строк.
+Задача, которая не обновляла его дольше ``IMPORT_JOB_STALE_AFTER``
+(процесс воркера умер), помечается ``FAILED`` (см. ``fail_stale_jobs``).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .common import save_csv_model, ImportResult
+from .models import ImportJob
+
+
+log = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMPORT_JOB_WORKERS,
+                thread_name_prefix="import-job",
+            )
+        return _executor
+
+
+def create_import_job(upload, model, encoding=None, user=None) -> ImportJob:
+    """Сохраняет загруженный файл и ставит его импорт в очередь."""
+    job = ImportJob.objects.create(
+        model_label=model._meta.label,
+        file=upload,
+        encoding=encoding or "utf-8",
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    if settings.IMPORT_JOBS_IN_PROCESS:
+        fail_stale_jobs()
+        transaction.on_commit(lambda: get_executor().submit(run_in_thread, job.pk))
+    return job
+
+
+def delete_upload(job: ImportJob) -> None:
+    if job.file:
+        job.file.storage.delete(job.file.name)
+
+
+def fail_stale_jobs() -> int:
+    """
+    Помечает ``FAILED`` задачи, которые зависли в ``RUNNING``.
+
+    Заново в очередь они не ставятся: уже сохранённые куски CSV
+    при повторном импорте задвоились бы.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER)
+    stale = ImportJob.objects.filter(
+        Q(heartbeat_at__lt=stale_before)
+        | Q(heartbeat_at__isnull=True, started_at__lt=stale_before),
+        status=ImportJob.Status.RUNNING,
+    )
+    failed = 0
+    for job in stale.only("pk", "file"):
+        # условие повторяется: задачу мог успеть завершить сам воркер
+        if stale.filter(pk=job.pk).update(
+            status=ImportJob.Status.FAILED,
+            error="Import worker stopped responding",
+            finished_at=timezone.now(),
+            file="",
+        ):
+            delete_upload(job)
+            failed += 1
+    if failed:
+        log.warning("Marked %s stale import jobs as failed", failed)
+    return failed
+
+
+def run_in_thread(job_pk: int, claimed: bool = False) -> None:
+    close_old_connections()
+    try:
+        run_import_job(job_pk, claimed=claimed)
+    except Exception:
+        log.exception("Import job %s crashed", job_pk)
+    finally:
+        close_old_connections()
+
+
+def claim_next_job():
+    """Забирает самую старую ожидающую задачу, если её не забрали другие."""
+    fail_stale_jobs()
+    pending = (
+        ImportJob.objects
+        .filter(status=ImportJob.Status.PENDING)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    for job_pk in pending[:10]:
+        if claim_job(job_pk):
+            return job_pk
+    return None
+
+
+def claim_job(job_pk: int) -> bool:
+    return bool(
+        ImportJob.objects
+        .filter(pk=job_pk, status=ImportJob.Status.PENDING)
+        .update(
+            status=ImportJob.Status.RUNNING,
+            started_at=timezone.now(),
+            heartbeat_at=timezone.now(),
+        )
+    )
+
+
+def run_import_job(job_pk: int, claimed: bool = False) -> None:
+    if not claimed and not claim_job(job_pk):
+        return
+
+    job = ImportJob.objects.get(pk=job_pk)
+    # задачу, которую fail_stale_jobs уже пометил FAILED, воркер не трогает
+    jobs = ImportJob.objects.filter(pk=job_pk, status=ImportJob.Status.RUNNING)
+
+    def progress(result: ImportResult):
+        jobs.update(
+            rows_done=result.rows,
+            rows_failed=result.failed,
+            rows_per_sec=result.rows_per_sec,
+            heartbeat_at=timezone.now(),
+        )
+
+    def on_error(rows, exc):
+        log.warning("Import job %s: %s rows failed: %s", job_pk, len(rows), exc)
+        jobs.update(error=str(exc)[:1000])
+
+    try:
+        model = apps.get_model(job.model_label)
+        with job.file.open("rb") as file:
+            result = save_csv_model(
+                file,
+                encoding=job.encoding,
+                model=model,
+                progress=progress,
+                on_error=on_error,
+            )
+    except Exception as exc:
+        log.exception("Import job %s failed", job_pk)
+        if jobs.update(
+            status=ImportJob.Status.FAILED,
+            error=str(exc)[:1000],
+            finished_at=timezone.now(),
+            file="",
+        ):
+            delete_upload(job)
+        return
+
+    if jobs.update(
+        status=ImportJob.Status.DONE,
+        rows_done=result.rows,
+        rows_failed=result.failed,
+        rows_per_sec=result.rows_per_sec,
+        finished_at=timezone.now(),
+        file="",
+    ):
+        delete_upload(job)
@@ -21,10 +21,8 @@ class Command(BaseCommand):
         # )
         # print(result)
 
-        orders = Order.objects.annotate(
-                total=Sum("products__price", default=0),
-                products_count=Count("products"),
-            )
+        # итоги хранятся в самом заказе, join и GROUP BY не нужны
+        orders = Order.objects.only("id", "total", "products_count")
         for order in orders:
             print(
                 f"Order # {order.id}"
@@ -0,0 +1,296 @@
+from contextlib import contextmanager
+from importlib import import_module
+from random import Random
+from timeit import default_timer
+import json
+import math
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, \
+    teardown_test_environment
+from django.urls import URLResolver, reverse
+from django.utils import timezone, translation
+
+from blogapp.models import Article, Author, Category
+from myauth.models import Profile
+from shopapp.models import Product, Order
+
+
+URL_MODULES = [
+    "shopapp.urls",
+    "blogapp.urls",
+    "myauth.urls",
+    "myapiapp.urls",
+]
+
+# адреса с параметрами: имя -> (имя URL, строка запроса)
+QUERY_URLS = {
+    # широкий поиск: под запрос подходят все товары
+    "shopapp:product-list?search": ("shopapp:product-list", "search=product"),
+    "shopapp:product-list?search&cursor": (
+        "shopapp:product-list",
+        "search=product&pagination=cursor",
+    ),
+}
+
+BENCH_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "bench",
+    }
+}
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    """
+    Seeds a scratch database and benchmarks every shop, blog, auth and api URL
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--orders", type=int, default=10_000)
+        parser.add_argument("--articles", type=int, default=1_000)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--current-db",
+            action="store_true",
+            help="Seed the current database instead of a scratch one (tests)",
+        )
+        parser.add_argument("--output", help="Write results to this JSON file")
+        parser.add_argument("--baseline", help="Compare results with this JSON file")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=1.25,
+            help="Allowed p95 latency / peak memory growth against the baseline",
+        )
+
+    @contextmanager
+    def scratch_database(self, options):
+        if options["current_db"]:
+            yield
+            return
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False,
+        )
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def handle(self, *args, **options):
+        with self.scratch_database(options), override_settings(CACHES=BENCH_CACHES):
+            dataset = self.seed(options)
+            endpoints = self.run_endpoints(options["repeat"])
+
+        results = {"dataset": dataset, "endpoints": endpoints}
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options["baseline"]:
+            self.compare(results, options["baseline"], options["tolerance"])
+
+    def seed(self, options):
+        self.stdout.write("Seed scratch database")
+        random = Random(options["seed"])
+        started = default_timer()
+
+        admin = User.objects.create_superuser("bench", password="bench")
+        User.objects.bulk_create(
+            User(username=f"user{i}") for i in range(options["users"])
+        )
+        users = list(User.objects.values_list("pk", flat=True))
+        Profile.objects.bulk_create(Profile(user_id=pk) for pk in users)
+
+        for start in range(0, options["products"], 5000):
+            Product.objects.bulk_create(
+                Product(
+                    name=f"Product {i}",
+                    description=f"Description of product {i}",
+                    price=random.randint(1, 5000),
+                    discount=random.randint(0, 50),
+                    created_by=admin,
+                )
+                for i in range(start, min(start + 5000, options["products"]))
+            )
+        products = list(Product.objects.values_list("pk", flat=True))
+
+        through = Order.products.through
+        for start in range(0, options["orders"], 5000):
+            orders = Order.objects.bulk_create(
+                Order(
+                    delivery_address=f"Street {i}",
+                    user_id=random.choice(users),
+                )
+                for i in range(start, min(start + 5000, options["orders"]))
+            )
+            if products:
+                through.objects.bulk_create(
+                    through(order_id=order.pk, product_id=product_id)
+                    for order in orders
+                    for product_id in random.sample(products, min(3, len(products)))
+                )
+        Order.objects.recompute_totals()
+
+        author = Author.objects.create(name="Bench author")
+        category = Category.objects.create(name="Bench")
+        for start in range(0, options["articles"], 5000):
+            Article.objects.bulk_create(
+                Article(
+                    title=f"Article {i}",
+                    content="Lorem ipsum " * 100,
+                    pub_date=timezone.now(),
+                    author=author,
+                    category=category,
+                )
+                for i in range(start, min(start + 5000, options["articles"]))
+            )
+
+        dataset = {
+            "users": len(users),
+            "products": len(products),
+            "orders": options["orders"],
+            "articles": options["articles"],
+        }
+        self.stdout.write(f"Seeded {dataset} in {default_timer() - started:.1f}s")
+        return dataset
+
+    def iter_urls(self):
+        user = User.objects.get(username="bench")
+        for module_name in URL_MODULES:
+            module = import_module(module_name)
+            for pattern in self.walk(module.urlpatterns):
+                names = list(pattern.pattern.regex.groupindex)
+                if "format" in names:
+                    continue
+                kwargs = {}
+                for name in names:
+                    value = user.pk if name == "user_id" else self.sample_pk(pattern.callback)
+                    if value is None:
+                        break
+                    kwargs[name] = value
+                else:
+                    name = f"{module.app_name}:{pattern.name}"
+                    yield name, reverse(name, kwargs=kwargs)
+        for name, (url_name, query) in QUERY_URLS.items():
+            yield name, f"{reverse(url_name)}?{query}"
+
+    def walk(self, patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from self.walk(pattern.url_patterns)
+            elif pattern.name:
+                yield pattern
+
+    def sample_pk(self, callback):
+        view_class = getattr(callback, "view_class", None) or getattr(callback, "cls", None)
+        model = getattr(view_class, "model", None)
+        queryset = getattr(view_class, "queryset", None)
+        if model is None and queryset is not None:
+            model = queryset.model
+        if model is None:
+            return None
+        return model._default_manager.order_by("pk").values_list("pk", flat=True).first()
+
+    def request(self, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            started = default_timer()
+            response = client.get(url)
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = default_timer() - started
+        return response.status_code, elapsed, len(queries)
+
+    def run_endpoints(self, repeat):
+        client = Client()
+        client.force_login(User.objects.get(username="bench"))
+
+        # i18n_patterns: ссылки строим для поддерживаемого языка, а не en-us
+        language = translation.get_supported_language_variant(settings.LANGUAGE_CODE)
+        with translation.override(language):
+            urls = dict(self.iter_urls())
+
+        results = {}
+        for name, url in urls.items():
+            # первый запрос - с пустыми кешами, остальные - тёплые
+            status, cold, cold_queries = self.request(client, url)
+            timings = []
+            for _ in range(repeat):
+                status, elapsed, queries = self.request(client, url)
+                timings.append(elapsed * 1000)
+
+            tracemalloc.start()
+            self.request(client, url)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {
+                "url": url,
+                "status": status,
+                "cold_ms": round(cold * 1000, 2),
+                "cold_queries": cold_queries,
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                "queries": queries,
+                "peak_kb": round(peak / 1024, 1),
+            }
+            self.stdout.write(
+                f"{name:40} {status} cold={results[name]['cold_ms']}ms "
+                f"cold_queries={cold_queries} p50={results[name]['p50_ms']}ms "
+                f"p95={results[name]['p95_ms']}ms queries={queries} "
+                f"peak={results[name]['peak_kb']}KB"
+            )
+        return results
+
+    def compare(self, results, baseline_path, tolerance):
+        with open(baseline_path) as file:
+            baseline = json.load(file)["endpoints"]
+
+        regressions = []
+        for name, current in results["endpoints"].items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            # 1 мс запаса, чтобы не ловить шум на быстрых страницах
+            if current["p95_ms"] > previous["p95_ms"] * tolerance + 1:
+                regressions.append(
+                    f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms"
+                )
+            if current["queries"] > previous["queries"]:
+                regressions.append(
+                    f"{name}: queries {previous['queries']} -> {current['queries']}"
+                )
+            if current["cold_queries"] > previous.get("cold_queries", current["cold_queries"]):
+                regressions.append(
+                    f"{name}: cold queries {previous['cold_queries']} -> {current['cold_queries']}"
+                )
+            if current["peak_kb"] > previous["peak_kb"] * tolerance + 64:
+                regressions.append(
+                    f"{name}: peak memory {previous['peak_kb']}KB -> {current['peak_kb']}KB"
+                )
+
+        if regressions:
+            raise CommandError(
+                "Performance regressions against baseline:\n" + "\n".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
@@ -0,0 +1,200 @@
+from random import Random
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from mysite.db import atomic_retry, is_lock_error, log as retry_log
+from .bench import percentile
+
+
+PROFILES = {
+    "default": {},
+    "production": settings.SQLITE_PRODUCTION_OPTIONS,
+}
+
+
+def register_database(alias: str, name: str, options: dict) -> None:
+    databases = {
+        DEFAULT_DB_ALIAS: dict(settings.DATABASES[DEFAULT_DB_ALIAS]),
+        alias: {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": name,
+            "OPTIONS": dict(options),
+        },
+    }
+    connections.settings[alias] = connections.configure_settings(databases)[alias]
+
+
+class CountingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Command(BaseCommand):
+    """
+    Runs concurrent read-modify-write transactions against scratch SQLite files
+    with the default and the production profile and counts lock errors
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8)
+        parser.add_argument("--readers", type=int, default=2)
+        parser.add_argument("--transactions", type=int, default=200, help="Per writer")
+        parser.add_argument(
+            "--profile",
+            action="append",
+            choices=sorted(PROFILES),
+            help="Profiles to run (default: all)",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options["profile"] or sorted(PROFILES):
+            with TemporaryDirectory() as directory:
+                alias = f"bench_{profile}"
+                register_database(alias, os.path.join(directory, "bench.sqlite3"), PROFILES[profile])
+                try:
+                    results[profile] = self.run_profile(alias, profile == "production", options)
+                finally:
+                    connections[alias].close()
+                    del connections[alias]
+                    connections.settings.pop(alias)
+
+        self.stdout.write(
+            f"{'profile':<12}{'committed':>10}{'lock errors':>13}{'retries':>9}"
+            f"{'tx/s':>9}{'p95 ms':>9}{'read errors':>13}"
+        )
+        for profile, result in results.items():
+            self.stdout.write(
+                f"{profile:<12}{result['committed']:>10}{result['failed']:>13}"
+                f"{result['retries']:>9}{result['tx_per_sec']:>9.0f}"
+                f"{result['p95_ms']:>9.1f}{result['read_failed']:>13}"
+            )
+
+        production = results.get("production")
+        if production is not None:
+            if production["failed"] or production["read_failed"]:
+                self.stdout.write(self.style.ERROR("Production profile still hits lock errors"))
+            else:
+                self.stdout.write(self.style.SUCCESS("No lock errors with the production profile"))
+        return None
+
+    def setup_schema(self, alias: str) -> None:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE bench_stock (id INTEGER PRIMARY KEY, quantity INTEGER NOT NULL)"
+            )
+            cursor.execute(
+                "CREATE TABLE bench_order ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, stock_id INTEGER NOT NULL, "
+                "quantity INTEGER NOT NULL)"
+            )
+            cursor.executemany(
+                "INSERT INTO bench_stock (id, quantity) VALUES (%s, %s)",
+                [(pk, 1_000_000) for pk in range(1, 11)],
+            )
+
+    def run_profile(self, alias: str, retry: bool, options) -> dict:
+        self.setup_schema(alias)
+        lock = threading.Lock()
+        stats = {"committed": 0, "failed": 0, "read_failed": 0}
+        durations = []
+        writing = threading.Event()
+        writing.set()
+
+        def place_order(stock_id):
+            # чтение, затем запись: в режиме DEFERRED две такие транзакции
+            # не могут обе повысить блокировку и одна сразу падает
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT quantity FROM bench_stock WHERE id = %s", [stock_id])
+                quantity = cursor.fetchone()[0]
+                cursor.execute(
+                    "INSERT INTO bench_order (stock_id, quantity) VALUES (%s, %s)",
+                    [stock_id, 1],
+                )
+                cursor.execute(
+                    "UPDATE bench_stock SET quantity = %s WHERE id = %s",
+                    [quantity - 1, stock_id],
+                )
+
+        if retry:
+            write = atomic_retry(place_order, using=alias)
+        else:
+            write = transaction.atomic(using=alias)(place_order)
+
+        def writer(number):
+            random = Random(options["seed"] + number)
+            try:
+                for _ in range(options["transactions"]):
+                    started = default_timer()
+                    try:
+                        write(random.randint(1, 10))
+                    except OperationalError as exc:
+                        if not is_lock_error(exc):
+                            raise
+                        with lock:
+                            stats["failed"] += 1
+                    else:
+                        with lock:
+                            stats["committed"] += 1
+                            durations.append(default_timer() - started)
+            finally:
+                connections[alias].close()
+
+        def reader():
+            try:
+                while writing.is_set():
+                    try:
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute("SELECT COUNT(*), SUM(quantity) FROM bench_order")
+                            cursor.fetchone()
+                    except OperationalError as exc:
+                        if not is_lock_error(exc):
+                            raise
+                        with lock:
+                            stats["read_failed"] += 1
+            finally:
+                connections[alias].close()
+
+        writers = [
+            threading.Thread(target=writer, args=(number,))
+            for number in range(options["writers"])
+        ]
+        readers = [threading.Thread(target=reader) for _ in range(options["readers"])]
+        # повторы считаются по предупреждениям atomic_retry
+        retries = CountingHandler()
+        retry_log.addHandler(retries)
+        propagate, retry_log.propagate = retry_log.propagate, False
+        started = default_timer()
+        try:
+            for thread in readers + writers:
+                thread.start()
+            for thread in writers:
+                thread.join()
+            seconds = default_timer() - started
+        finally:
+            writing.clear()
+            for thread in readers:
+                thread.join()
+            retry_log.removeHandler(retries)
+            retry_log.propagate = propagate
+
+        return {
+            "committed": stats["committed"],
+            "failed": stats["failed"],
+            "retries": retries.count,
+            "read_failed": stats["read_failed"],
+            "tx_per_sec": stats["committed"] / seconds if seconds else 0.0,
+            "p95_ms": percentile(durations, 95) * 1000 if durations else 0.0,
+        }
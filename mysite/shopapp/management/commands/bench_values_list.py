@@ -0,0 +1,87 @@
+from statistics import median
+from timeit import default_timer
+
+from django.core.management import CommandError
+from django.db.models.functions import Mod
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from shopapp.models import Order, Product
+from shopapp.serializers import OrderSerializers, ProductSerializers
+from shopapp.values import ValuesRows
+from .bench import Command as BenchCommand, percentile
+
+
+class Command(BenchCommand):
+    """
+    Seeds a scratch database and compares the DRF list serializers with the
+    values()-based read path (ms per 1k rows, output must be byte-identical)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20_000)
+        parser.add_argument("--orders", type=int, default=10_000)
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--rows", type=int, default=1_000, help="Rows per page")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--current-db", action="store_true")
+
+    def handle(self, *args, **options):
+        with self.scratch_database(options):
+            self.seed({**options, "articles": 0})
+            # половина товаров с картинкой: адрес файла строится для каждой строки
+            Product.objects.annotate(parity=Mod("pk", 2)).filter(parity=0).update(
+                preview="products/product_preview/bench.jpg",
+            )
+            results = [
+                self.measure("products", ProductSerializers, Product.objects.all(), options),
+                self.measure("orders", OrderSerializers, Order.objects.all(), options),
+            ]
+
+        self.stdout.write(
+            f"{'list':<10}{'rows':>7}{'serializer ms/1k':>18}{'values ms/1k':>14}"
+            f"{'p95 ms/1k':>11}{'speedup':>9}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['name']:<10}{result['rows']:>7}{result['serializer']:>18.1f}"
+                f"{result['values']:>14.1f}{result['values_p95']:>11.1f}"
+                f"{result['serializer'] / result['values']:>8.1f}x"
+            )
+
+    def measure(self, name, serializer_class, queryset, options) -> dict:
+        rows = options["rows"]
+        context = {"request": Request(APIRequestFactory().get("/"))}
+        queryset = queryset.order_by("pk")
+
+        def serializer_path():
+            # как в ProductViewSet.list: only() и prefetch от SparseFieldsMixin
+            serializer = serializer_class(context=context)
+            objects = list(serializer.narrow_queryset(queryset)[:rows])
+            return serializer_class(objects, many=True, context=context).data
+
+        def values_path():
+            values_rows = ValuesRows.compile(serializer_class(context=context))
+            return values_rows.convert(values_rows.prepare(queryset)[:rows])
+
+        renderer = JSONRenderer()
+        if renderer.render(serializer_path()) != renderer.render(values_path()):
+            raise CommandError(f"{name}: values() output differs from the serializer")
+
+        timings = {}
+        for path_name, path in (("serializer", serializer_path), ("values", values_path)):
+            elapsed = []
+            for _ in range(options["repeat"]):
+                started = default_timer()
+                path()
+                elapsed.append((default_timer() - started) * 1000 * 1000 / rows)
+            timings[path_name] = elapsed
+        return {
+            "name": name,
+            "rows": rows,
+            "serializer": median(timings["serializer"]),
+            "values": median(timings["values"]),
+            "values_p95": percentile(timings["values"], 95),
+        }
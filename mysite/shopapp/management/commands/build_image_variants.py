@@ -0,0 +1,76 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from shopapp.images import create_pool, has_variants, read_original, \
+    render_variants, save_variants, watched_fields
+
+
+class Command(BaseCommand):
+    """
+    Builds missing image variants for existing media in a process pool
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.IMAGE_VARIANT_WORKERS)
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild variants that already exist",
+        )
+
+    def iter_images(self, force):
+        for model, field_name, on_done in watched_fields:
+            objects = (
+                model._default_manager
+                .exclude(**{f"{field_name}__isnull": True})
+                .exclude(**{field_name: ""})
+                .only("pk", field_name)
+                .order_by("pk")
+                .iterator(chunk_size=500)
+            )
+            for obj in objects:
+                field_file = getattr(obj, field_name)
+                if force or not has_variants(field_file, cached=False):
+                    yield obj, field_file, on_done
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        widths = settings.IMAGE_VARIANT_WIDTHS
+        self.stdout.write(f"Build image variants with {workers} processes")
+
+        built = failed = 0
+        pending = {}
+        images = self.iter_images(options["force"])
+        with create_pool(workers) as pool:
+            while True:
+                # не больше двух картинок на процесс в памяти одновременно
+                for obj, field_file, on_done in images:
+                    try:
+                        data = read_original(field_file)
+                    except OSError as exc:
+                        self.stderr.write(f"{field_file.name}: {exc}")
+                        failed += 1
+                        continue
+                    future = pool.submit(render_variants, data, widths)
+                    pending[future] = obj, field_file, on_done
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    obj, field_file, on_done = pending.pop(future)
+                    try:
+                        save_variants(field_file, future.result())
+                    except Exception as exc:
+                        self.stderr.write(f"{field_file.name}: {exc}")
+                        failed += 1
+                        continue
+                    if on_done:
+                        on_done(obj)
+                    built += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Built variants for {built} images, {failed} failed"))
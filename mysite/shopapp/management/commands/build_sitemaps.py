@@ -0,0 +1,34 @@
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from mysite.sitemaps import build_sitemaps
+
+
+class Command(BaseCommand):
+    """
+    Writes the sitemap index and the sitemap sections to SITEMAP_ROOT,
+    regenerating only the sections whose rows changed since the last run
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default=settings.SITEMAP_BASE_URL)
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rewrite all sections",
+        )
+
+    def handle(self, *args, **options):
+        started = default_timer()
+        result = build_sitemaps(base_url=options["base_url"], force=options["force"])
+        for name in result["written"]:
+            self.stdout.write(f"Written {name}")
+        for name in result["removed"]:
+            self.stdout.write(f"Removed {name}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Sitemaps in {settings.SITEMAP_ROOT}: {len(result['written'])} written, "
+            f"{result['unchanged']} unchanged, {len(result['removed'])} removed "
+            f"in {default_timer() - started:.2f}s"
+        ))
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.core.management import BaseCommand
+
+from shopapp.jobs import claim_next_job, run_in_thread
+
+
+class Command(BaseCommand):
+    """
+    Processes pending CSV import jobs
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--poll-interval", type=float, default=2.0)
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Process pending jobs and exit",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        self.stdout.write(f"Import worker started with {workers} threads")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                futures = []
+                for _ in range(workers):
+                    job_pk = claim_next_job()
+                    if job_pk is None:
+                        break
+                    self.stdout.write(f"Processing import job #{job_pk}")
+                    futures.append(executor.submit(run_in_thread, job_pk, True))
+                for future in futures:
+                    future.result()
+
+                if not futures:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS("Import worker stopped"))
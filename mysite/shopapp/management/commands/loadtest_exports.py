@@ -0,0 +1,211 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connections
+from django.urls import reverse
+from django.utils import translation
+
+from shopapp.models import Order, Product
+from .bench import percentile
+from .bench_sqlite_writers import register_database
+
+
+SEED_ALIAS = "loadtest_seed"
+MODES = ("wsgi", "asgi")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    """
+    Starts gunicorn in sync (WSGI) and uvicorn (ASGI) mode on a seeded scratch
+    database, keeps workers busy with slow export downloads and measures how
+    fast other requests are served meanwhile
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", action="append", choices=MODES, help="Modes to run (default: both)")
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--orders", type=int, default=20_000)
+        parser.add_argument("--slow-clients", type=int, default=6)
+        parser.add_argument(
+            "--read-rate",
+            type=int,
+            default=256 * 1024,
+            help="Bytes per second read by each slow client",
+        )
+        parser.add_argument("--probes", type=int, default=40)
+        parser.add_argument("--probe-timeout", type=float, default=15.0)
+
+    def handle(self, *args, **options):
+        with TemporaryDirectory() as directory:
+            self.seed(directory, options["orders"])
+            with translation.override("en"):
+                slow_path = reverse("shopapp:orders-export")
+                probe_path = reverse("shopapp:products-export")
+
+            results = {}
+            for mode in options["mode"] or MODES:
+                self.stdout.write(f"{mode}: {options['workers']} workers, "
+                                  f"{options['slow_clients']} slow clients")
+                results[mode] = self.run_mode(mode, directory, slow_path, probe_path, options)
+
+        self.stdout.write(
+            f"{'mode':<6}{'probes ok':>11}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}"
+            f"{'slow done':>11}{'slow avg s':>12}"
+        )
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<6}{result['probes_ok']:>11}{result['p50_ms']:>9.0f}"
+                f"{result['p95_ms']:>9.0f}{result['max_ms']:>9.0f}"
+                f"{result['slow_done']:>11}{result['slow_avg_s']:>12.1f}"
+            )
+
+    def seed(self, directory: str, orders: int) -> None:
+        register_database(SEED_ALIAS, os.path.join(directory, "db.sqlite3"), {})
+        try:
+            call_command("migrate", database=SEED_ALIAS, verbosity=0)
+            user = User.objects.db_manager(SEED_ALIAS).create_user(username="loadtest")
+            products = Product.objects.using(SEED_ALIAS).bulk_create(
+                Product(name=f"Product {i}", price=i + 1, created_by=user)
+                for i in range(100)
+            )
+            created = Order.objects.using(SEED_ALIAS).bulk_create(
+                (
+                    Order(delivery_address=f"Street {i}, house {i % 97}", user=user)
+                    for i in range(orders)
+                ),
+                batch_size=2000,
+            )
+            through = Order.products.through
+            through.objects.using(SEED_ALIAS).bulk_create(
+                (
+                    through(order_id=order.pk, product_id=products[(order.pk + shift) % 100].pk)
+                    for order in created
+                    for shift in range(3)
+                ),
+                batch_size=5000,
+            )
+        finally:
+            connections[SEED_ALIAS].close()
+            del connections[SEED_ALIAS]
+            connections.settings.pop(SEED_ALIAS)
+
+    def start_server(self, mode: str, directory: str, port: int, workers: int):
+        env = {
+            **os.environ,
+            "DJANGO_ASGI": "1" if mode == "asgi" else "0",
+            "DJANGO_DATABASE_DIR": directory,
+            "DJANGO_DEBUG": "0",
+        }
+        base_dir = Path(settings.BASE_DIR)
+        return subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn",
+                "-c", str(base_dir / "gunicorn.conf.py"),
+                "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers),
+                "--log-level", "warning",
+            ],
+            cwd=base_dir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+
+    @staticmethod
+    def get(port: int, path: str, timeout: float) -> int:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def wait_ready(self, server, port: int, path: str) -> None:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("gunicorn exited, see its output above")
+            try:
+                if self.get(port, path, timeout=5) == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise CommandError("gunicorn did not start in 60s")
+
+    @staticmethod
+    def slow_download(port: int, path: str, rate: int) -> float:
+        """Читает ответ со скоростью ``rate`` байт/с через маленький буфер сокета."""
+        started = default_timer()
+        with socket.socket() as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.connect(("127.0.0.1", port))
+            sock.sendall(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+            chunk = 4096
+            while sock.recv(chunk):
+                time.sleep(chunk / rate)
+        return default_timer() - started
+
+    def run_mode(self, mode: str, directory: str, slow_path: str, probe_path: str, options) -> dict:
+        port = free_port()
+        server = self.start_server(mode, directory, port, options["workers"])
+        try:
+            self.wait_ready(server, port, probe_path)
+
+            slow_times = []
+            slow_threads = [
+                threading.Thread(
+                    target=lambda: slow_times.append(
+                        self.slow_download(port, slow_path, options["read_rate"])
+                    ),
+                )
+                for _ in range(options["slow_clients"])
+            ]
+            for thread in slow_threads:
+                thread.start()
+            # медленные клиенты успевают занять воркеры
+            time.sleep(1)
+
+            latencies = []
+            for _ in range(options["probes"]):
+                started = default_timer()
+                try:
+                    status = self.get(port, probe_path, timeout=options["probe_timeout"])
+                except OSError:
+                    continue
+                if status == 200:
+                    latencies.append(default_timer() - started)
+
+            for thread in slow_threads:
+                thread.join()
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        latencies_ms = [value * 1000 for value in latencies] or [0.0]
+        return {
+            "probes_ok": len(latencies),
+            "p50_ms": percentile(latencies_ms, 50),
+            "p95_ms": percentile(latencies_ms, 95),
+            "max_ms": max(latencies_ms),
+            "slow_done": len(slow_times),
+            "slow_avg_s": sum(slow_times) / len(slow_times) if slow_times else 0.0,
+        }
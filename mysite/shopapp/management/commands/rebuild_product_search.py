@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+
+from shopapp.search import install_search_index
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds full-text search index for products
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuild product search index")
+        connection = connections[options["database"]]
+        if not install_search_index(connection):
+            raise CommandError("Full-text search needs SQLite with FTS5")
+        self.stdout.write(self.style.SUCCESS("Product search index rebuilt"))
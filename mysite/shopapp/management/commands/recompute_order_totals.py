@@ -0,0 +1,36 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Min, Q
+
+from shopapp.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Repairs drifted denormalized order totals in batches
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.stdout.write("Recompute order totals")
+        batch_size = options["batch_size"]
+        bounds = Order.objects.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            self.stdout.write("No orders found")
+            return
+
+        repaired = 0
+        for start in range(bounds["first"], bounds["last"] + 1, batch_size):
+            with transaction.atomic():
+                drifted = (
+                    Order.objects
+                    .filter(pk__gte=start, pk__lt=start + batch_size)
+                    .with_real_totals()
+                    .filter(~Q(total=F("real_total")) | ~Q(products_count=F("real_count")))
+                    .values_list("pk", flat=True)
+                )
+                repaired += Order.objects.filter(pk__in=list(drifted)).recompute_totals()
+
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} orders"))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+from shopapp.search import install_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0014_importjob"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="description",
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-18 06:23
+
+from django.db import migrations, models
+
+from shopapp.models import order_totals_expressions
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model("shopapp", "Order")
+    Order.objects.using(schema_editor.connection.alias).update(
+        **order_totals_expressions(Order.products.through)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0015_product_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="products_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total",
+            field=models.DecimalField(
+                db_index=True, decimal_places=2, default=0, max_digits=12
+            ),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
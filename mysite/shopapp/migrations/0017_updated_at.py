@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:30
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+from shopapp.search import install_search_index
+
+
+def fill_updated_at(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    for model_name in ("Product", "Order"):
+        model = apps.get_model("shopapp", model_name)
+        model.objects.using(alias).update(updated_at=F("created_at"))
+
+
+def reinstall_search_index(apps, schema_editor):
+    # AddField/RemoveField пересоздают таблицу товаров на SQLite вместе с триггерами
+    install_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0016_order_totals"),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_index),
+        migrations.AddField(
+            model_name="product",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
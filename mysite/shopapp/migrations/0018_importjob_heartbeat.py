@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0017_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 08:03
+
+import django.db.models.deletion
+import shopapp.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopapp", "0018_importjob_heartbeat"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSearchEntry",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search_entry",
+                        serialize=False,
+                        to="shopapp.product",
+                    ),
+                ),
+                (
+                    "document",
+                    shopapp.search.SearchDocumentField(db_column="shopapp_product_fts"),
+                ),
+                ("rank", models.FloatField()),
+            ],
+            options={
+                "db_table": "shopapp_product_fts",
+                "managed": False,
+            },
+        ),
+    ]
@@ -1,9 +1,17 @@
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from .search import FTS_TABLE, SearchDocumentField
+from .versions import VersionedQuerySet
+
 
 def product_preview_directory_path(instance: "Product", filename: str) -> str:
     return "products/product_{pk}/preview/{filename}".format(
@@ -11,6 +19,23 @@ def product_preview_directory_path(instance: "Product", filename: str) -> str:
         filename=filename
     )
 
+class ProductQuerySet(VersionedQuerySet):
+    def update(self, **kwargs):
+        if "price" not in kwargs:
+            return super().update(**kwargs)
+        order_ids = list(
+            Order.products.through.objects
+            .filter(product_id__in=self.values("pk"))
+            .values_list("order_id", flat=True)
+            .distinct()
+        )
+        rows = super().update(**kwargs)
+        Order.objects.recompute_totals_for(order_ids)
+        return rows
+
+    update.alters_data = True
+
+
 class Product(models.Model):
     """Модель Product представляет собой товар,
     который можно продавать в магазине.
@@ -23,22 +48,48 @@ class Product(models.Model):
         verbose_name_plural = _('Products')
 
     name = models.CharField(max_length=100, db_index=True)
-    description = models.TextField(null=False, blank=True, db_index=True)
+    description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2,
                                 validators=[MinValueValidator(1)]
                                 )
     discount = models.SmallIntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
     created_at = models.DateTimeField(auto_now_add=True)
+    # save(), update() и bulk_update() (VersionedQuerySet) обновляют поле сами
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     archived = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
 
     def get_absolute_url(self):
         return reverse("shopapp:product_details", kwargs={"pk":self.pk})
 
+class ProductSearchEntry(models.Model):
+    """
+    Строка FTS5-индекса товаров, только для чтения (см. ``search.py``).
+
+    Таблицу и триггеры создаёт ``install_search_index`` в миграциях.
+    """
+    class Meta:
+        managed = False
+        db_table = FTS_TABLE
+
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        db_column="rowid",
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+        related_name="search_entry",
+    )
+    document = SearchDocumentField(db_column=FTS_TABLE)
+    rank = models.FloatField()
+
+
 def poduct_images_directory_path(instance: "Product", filename: str) -> str:
     return "products/product_{pk}/images/{filename}".format(
         pk=instance.product.pk,
@@ -52,6 +103,48 @@ class ProductImage(models.Model):
     description = models.CharField(max_length=200, null=False, blank=True)
 
 
+def order_totals_expressions(through) -> dict:
+    """Выражения для итогов заказа по его товарам (для annotate/update)."""
+    links = through.objects.filter(order_id=OuterRef("pk")).order_by().values("order_id")
+    return {
+        "total": Coalesce(
+            Subquery(links.annotate(total=Sum("product__price")).values("total")),
+            Value(Decimal(0)),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+        "products_count": Coalesce(
+            Subquery(links.annotate(count=Count("pk")).values("count")),
+            0,
+        ),
+    }
+
+
+class OrderQuerySet(VersionedQuerySet):
+    def with_real_totals(self):
+        """Аннотирует ``real_total``/``real_count``, посчитанные по товарам заказа."""
+        expressions = order_totals_expressions(self.model.products.through)
+        return self.annotate(
+            real_total=expressions["total"],
+            real_count=expressions["products_count"],
+        )
+
+    def recompute_totals(self) -> int:
+        """Пересчитывает ``total`` и ``products_count`` одним UPDATE."""
+        # итоги не входят в закешированные выгрузки, поэтому версию
+        # модели (и кеши заказов всех пользователей) не сбрасываем;
+        # в API они есть, поэтому updated_at (ETag) меняется
+        return models.QuerySet.update(
+            self,
+            updated_at=timezone.now(),
+            **order_totals_expressions(self.model.products.through),
+        )
+
+    def recompute_totals_for(self, order_ids, batch_size=5000) -> None:
+        order_ids = list(order_ids)
+        for start in range(0, len(order_ids), batch_size):
+            self.filter(pk__in=order_ids[start:start + batch_size]).recompute_totals()
+
+
 class Order(models.Model):
 
     class Meta:
@@ -61,6 +154,49 @@ class Order(models.Model):
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # ещё и при изменении товаров и итогов заказа (см. recompute_totals)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
     receipt = models.FileField(null=True, blank=True, upload_to='orders/receipts/')
+    # денормализованные итоги, их поддерживают сигналы (см. signals.py)
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, db_index=True)
+    products_count = models.PositiveIntegerField(default=0)
+
+    objects = OrderQuerySet.as_manager()
+
+
+class ImportJob(models.Model):
+    """
+    Фоновый импорт CSV-файла в модель магазина.
+
+    Файл сохраняется на диск при загрузке, а обрабатывается
+    пулом потоков или командой ``manage.py import_worker``.
+    """
+    class Meta:
+        ordering = ["-pk"]
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    model_label = models.CharField(max_length=100)
+    file = models.FileField(upload_to="imports/")
+    encoding = models.CharField(max_length=20, default="utf-8")
+    status = models.CharField(max_length=10, choices=Status.choices,
+                              default=Status.PENDING, db_index=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    rows_per_sec = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # обновляется после каждого куска строк (см. jobs.fail_stale_jobs)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"ImportJob(pk={self.pk}, model={self.model_label!r}, status={self.status!r})"
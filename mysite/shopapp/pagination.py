@@ -0,0 +1,313 @@
+"""
+Пагинация магазина: REST API и HTML-списки.
+
+По умолчанию - обычные номера страниц. С параметром ``?pagination=cursor``
+(или ``?cursor=...``) включается keyset-пагинация: следующая страница
+выбирается условием ``WHERE (поля сортировки) > (значения последней строки)``,
+без ``COUNT(*)`` и ``OFFSET``, поэтому любая страница стоит как первая.
+
+Число страниц в HTML-списках считается по закешированному ``COUNT(*)``,
+который сбрасывается версиями моделей (см. ``versions.py``).
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+from decimal import Decimal
+from functools import reduce
+import binascii
+import json
+import operator
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .versions import cached_count
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        # полная точность: DjangoJSONEncoder обрезает микросекунды
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def keyset_ordering(queryset, ordering=None) -> list:
+    """Сортировка для keyset-пагинации, дополненная ``pk`` для уникальности."""
+    if not ordering:
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+    ordering = [field for field in ordering if isinstance(field, str)]
+
+    unique = {"pk", queryset.model._meta.pk.name}
+    if not any(field.lstrip("-") in unique for field in ordering):
+        ordering.append("pk")
+    return ordering
+
+
+def get_position(obj, ordering, model=None) -> list:
+    """
+    Значения полей сортировки строки - позиция для курсора.
+
+    Строка - модель или словарь ``values()`` (тогда нужен ``model``).
+    """
+    meta = (model or type(obj))._meta
+    position = []
+    for field in ordering:
+        name = field.lstrip("-")
+        try:
+            attname = "pk" if name == "pk" else meta.get_field(name).attname
+        except FieldDoesNotExist:
+            attname = name
+        value = obj[attname] if isinstance(obj, dict) else getattr(obj, attname)
+        position.append(_encode_value(value))
+    return position
+
+
+def after_position(ordering, position) -> Q:
+    """(a, b, pk) > (x, y, z) в виде a > x OR (a = x AND b > y) OR ..."""
+    clauses = []
+    equal = {}
+    for field, value in zip(ordering, position):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        clauses.append(Q(**equal, **{f"{name}__{lookup}": value}))
+        equal[name] = value
+    return reduce(operator.or_, clauses)
+
+
+def encode_cursor(position) -> str:
+    return urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(encoded: str, ordering, model) -> list:
+    """
+    Позиция из курсора, значения приведены ``to_python()`` полей сортировки;
+    ``ValueError``, если курсор испорчен.
+    """
+    meta = model._meta
+    try:
+        position = json.loads(urlsafe_b64decode(encoded.encode()))
+        if not isinstance(position, list) or len(position) != len(ordering):
+            raise ValueError("Invalid cursor")
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            try:
+                model_field = meta.pk if name == "pk" else meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            position[index] = model_field.to_python(position[index])
+    except (TypeError, ValueError, ValidationError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по курсору на полях сортировки запроса.
+
+    Сортировка берётся из ``OrderingFilter`` представления (или из
+    queryset/Meta модели) и дополняется ``pk``, чтобы позиция строки
+    была уникальной.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(request, queryset, view)
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_position = self.get_position(results[-1]) if self.has_next else None
+        return results
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, "filter_backends", []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+        return keyset_ordering(queryset, ordering)
+
+    def get_position(self, obj):
+        return get_position(obj, self.ordering, self.model)
+
+    def after(self, position) -> Q:
+        return after_position(self.ordering, position)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return decode_cursor(encoded, self.ordering, self.model)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position) -> str:
+        return encode_cursor(position)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class ShopPagination(PageNumberPagination):
+    """
+    Номера страниц по умолчанию, keyset-курсор по запросу клиента.
+    """
+
+    mode_query_param = "pagination"
+    cursor_query_param = KeysetPagination.cursor_query_param
+
+    keyset = None
+
+    def use_keyset(self, request) -> bool:
+        params = request.query_params
+        return params.get(self.mode_query_param) == "cursor" or self.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.get_page_size(request)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset is not None:
+            return None
+        return super().get_previous_link()
+
+
+class CachedCountPaginator(Paginator):
+    """
+    ``Paginator``, который берёт ``count`` из кеша.
+
+    ``count_versions`` - модели или пары ``(model, scope)``, изменения
+    которых сбрасывают закешированное число строк.
+    """
+
+    def __init__(self, *args, count_versions=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_versions = count_versions
+
+    @cached_property
+    def count(self):
+        if not self.count_versions:
+            return super().count
+        return cached_count(self.object_list, *self.count_versions)
+
+
+class KeysetListMixin:
+    """
+    Пагинация для ``ListView``: номера страниц с кешированным числом строк
+    или, с ``?pagination=cursor``, кнопка "load more" на keyset-курсоре.
+
+    В режиме курсора ``COUNT(*)`` не выполняется, в контекст попадает
+    ``next_page_url`` (None на последней странице).
+    """
+
+    paginate_by = 20
+    paginator_class = CachedCountPaginator
+    count_versions = ()
+    mode_query_param = ShopPagination.mode_query_param
+    cursor_query_param = KeysetPagination.cursor_query_param
+
+    next_page_url = None
+
+    def get_count_versions(self):
+        return self.count_versions
+
+    def get_paginator(self, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(
+            queryset,
+            per_page,
+            orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page,
+            count_versions=self.get_count_versions(),
+            **kwargs,
+        )
+
+    def use_cursor(self) -> bool:
+        params = self.request.GET
+        return params.get(self.mode_query_param) == "cursor" or self.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_cursor():
+            return super().paginate_queryset(queryset, page_size)
+
+        ordering = keyset_ordering(queryset)
+        queryset = queryset.order_by(*ordering)
+        encoded = self.request.GET.get(self.cursor_query_param)
+        if encoded:
+            try:
+                position = decode_cursor(encoded, ordering, queryset.model)
+            except ValueError:
+                raise Http404(KeysetPagination.invalid_cursor_message)
+            queryset = queryset.filter(after_position(ordering, position))
+
+        object_list = list(queryset[:page_size + 1])
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            self.next_page_url = replace_query_param(
+                self.request.get_full_path(),
+                self.cursor_query_param,
+                encode_cursor(get_position(object_list[-1], ordering)),
+            )
+        return None, None, object_list, self.next_page_url is not None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["next_page_url"] = self.next_page_url
+        return context
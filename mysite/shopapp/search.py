@@ -0,0 +1,162 @@
+"""
+Полнотекстовый поиск товаров на SQLite FTS5.
+
+Индекс ``shopapp_product_fts`` - external content таблица над
+``shopapp_product``. Её синхронизируют триггеры SQLite, поэтому индекс
+обновляется при любом способе записи: ``save()``, ``update()``,
+``bulk_create()``, импорте CSV и ``loaddata``.
+
+Товары соединяются с индексом одним JOIN через модель ``ProductSearchEntry``
+(``managed = False``): строки и ``rank`` берутся из одного прохода MATCH.
+
+На других базах поиск откатывается к обычному ``LIKE``.
+"""
+import re
+
+from django.db import connections, models
+from django.db.models import F, Lookup, QuerySet
+from rest_framework.filters import SearchFilter
+
+
+FTS_TABLE = "shopapp_product_fts"
+PRODUCT_TABLE = "shopapp_product"
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name,
+        description,
+        content='{PRODUCT_TABLE}',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF name, description ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+_available = {}
+
+
+class Match(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", [*lhs_params, *rhs_params]
+
+
+class SearchDocumentField(models.TextField):
+    """Скрытый столбец FTS5 с именем таблицы: ``MATCH`` по всем колонкам индекса."""
+
+
+SearchDocumentField.register_lookup(Match)
+
+
+def install_search_index(connection, rebuild=True) -> bool:
+    """
+    Создаёт индекс и триггеры (если их нет) и перестраивает индекс.
+
+    Вызывается из миграций: пересоздание таблицы товаров на SQLite
+    удаляет её триггеры. Возвращает False, если FTS5 недоступен.
+    """
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        if not any("FTS5" in row[0] for row in cursor.fetchall()):
+            return False
+        for sql in CREATE_SQL:
+            cursor.execute(sql)
+        if rebuild:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _available.clear()
+    return True
+
+
+def uninstall_search_index(connection) -> None:
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for sql in DROP_SQL:
+            cursor.execute(sql)
+    _available.clear()
+
+
+def search_available(using="default") -> bool:
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    key = (using, str(connection.settings_dict["NAME"]))
+    if key not in _available:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [FTS_TABLE],
+            )
+            _available[key] = cursor.fetchone() is not None
+    return _available[key]
+
+
+def build_match_query(text: str) -> str:
+    """Каждое слово запроса ищется как префикс: ``lap pro`` -> ``"lap"* "pro"*``."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text))
+
+
+def search_products(queryset: QuerySet, text: str) -> QuerySet:
+    """
+    Фильтрует товары по индексу и сортирует по релевантности (bm25).
+
+    Ранг доступен в выборке как ``search_rank``.
+    """
+    match = build_match_query(text)
+    if not match:
+        return queryset
+    return (
+        queryset
+        .filter(search_entry__document__match=match)
+        .annotate(search_rank=F("search_entry__rank"))
+        .order_by("search_rank")
+    )
+
+class ProductSearchFilter(SearchFilter):
+    """
+    ``SearchFilter`` для товаров через FTS5-индекс с сортировкой по релевантности.
+
+    Параметр запроса тот же (``?search=``), ``search_fields`` представления
+    используются только там, где индекса нет.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or not search_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, " ".join(terms))
@@ -1,8 +1,55 @@
+from django.contrib.auth.models import User
 from rest_framework import serializers
 
-from .models import Product, Order
+from .images import WEBP, variant_srcset
+from .models import Product, Order, ImportJob, ProductImage
+from .sparse import SparseFieldsMixin
+
+
+class ImageVariantsField(serializers.ImageField):
+    """Картинка с ``srcset`` её вариантов (только для чтения)."""
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return {
+            "url": super().to_representation(value),
+            "srcset": variant_srcset(value),
+            "webp_srcset": variant_srcset(value, WEBP),
+        }
+
+
+class UserSerializers(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = (
+            "pk",
+            "username",
+        )
+
+
+class ProductImageSerializers(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ProductImage
+        fields = (
+            "pk",
+            "product",
+            "image",
+            "description",
+        )
+
+
+class ProductSerializers(SparseFieldsMixin, serializers.ModelSerializer):
+    preview_variants = ImageVariantsField(source="preview")
+
+    expandable_fields = {
+        "images": (ProductImageSerializers, {"many": True}),
+    }
 
-class ProductSerializers(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = (
@@ -12,12 +59,36 @@ class ProductSerializers(serializers.ModelSerializer):
             "description",
             "discount",
             "created_at",
+            "updated_at",
             "archived",
             "preview",
+            "preview_variants",
         )
 
 
-class OrderSerializers(serializers.ModelSerializer):
+class OrderSerializers(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        "products": (ProductSerializers, {"many": True}),
+        "user": (UserSerializers, {}),
+    }
+
     class Meta:
         model = Order
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+
+class ImportJobSerializers(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = (
+            "pk",
+            "model_label",
+            "status",
+            "rows_done",
+            "rows_failed",
+            "rows_per_sec",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        )
@@ -0,0 +1,142 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_save, \
+    pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .images import watch_image_field
+from .models import Product, Order, ProductImage
+from .versions import bump_version, object_scope
+
+
+def product_images_ready(instance):
+    # в закешированных фрагментах товара должен появиться srcset
+    product_id = instance.pk if isinstance(instance, Product) else instance.product_id
+    bump_version(Product, object_scope(product_id))
+    if isinstance(instance, Product):
+        # srcset превью есть в API: меняется updated_at (ETag) товара
+        Product.objects.filter(pk=product_id).touch()
+
+
+watch_image_field(Product, "preview", on_done=product_images_ready)
+watch_image_field(ProductImage, "image", on_done=product_images_ready)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance: Product, **kwargs):
+    bump_version(Product)
+    bump_version(Product, object_scope(instance.pk))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance: ProductImage, **kwargs):
+    # картинки входят в закешированные фрагменты товара и в API (?expand=images)
+    bump_version(Product, object_scope(instance.product_id))
+    Product.objects.filter(pk=instance.product_id).touch()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance: User, update_fields=None, **kwargs):
+    # пользователь раскрывается в заказах API (?expand=user); вход не в счёт
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_version(User)
+
+
+@receiver(pre_save, sender=Product)
+def product_remember_price(sender, instance: Product, **kwargs):
+    if instance._state.adding:
+        instance._previous_price = None
+        return
+    instance._previous_price = (
+        Product.objects
+        .filter(pk=instance.pk)
+        .values_list("price", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance: Product, created, **kwargs):
+    previous_price = getattr(instance, "_previous_price", None)
+    if created or previous_price is None or previous_price == instance.price:
+        return
+    Order.objects.filter(products=instance).recompute_totals()
+
+
+@receiver(pre_delete, sender=Product)
+def product_remember_orders(sender, instance: Product, **kwargs):
+    # связи с заказами удаляются каскадом без m2m_changed
+    instance._order_ids = list(
+        Order.products.through.objects
+        .filter(product_id=instance.pk)
+        .values_list("order_id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs):
+    Order.objects.recompute_totals_for(getattr(instance, "_order_ids", []))
+
+
+@receiver(pre_save, sender=Order)
+def order_remember_user(sender, instance: Order, **kwargs):
+    # если заказ передали другому пользователю, сбросить нужно и кеш прежнего
+    if instance._state.adding:
+        instance._previous_user_id = None
+        return
+    instance._previous_user_id = (
+        Order.objects
+        .filter(pk=instance.pk)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance: Order, **kwargs):
+    user_ids = {instance.user_id, getattr(instance, "_previous_user_id", None)}
+    for user_id in user_ids - {None}:
+        bump_version(Order, scope=user_id)
+    bump_version(Order, object_scope(instance.pk))
+    if kwargs.get("created", True):
+        # число заказов (пагинация списка) меняется только при создании и удалении
+        bump_version(Order, scope="rows")
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            bump_version(Order, scope=instance.user_id)
+            bump_version(Order, object_scope(instance.pk))
+            Order.objects.filter(pk=instance.pk).recompute_totals()
+            instance.refresh_from_db(fields=["total", "products_count", "updated_at"])
+        return
+
+    # изменение со стороны товара: product.orders.add(...) и т.п.
+    if action == "pre_clear":
+        instance._cleared_order_ids = list(
+            Order.objects.filter(products=instance).values_list("pk", flat=True)
+        )
+        return
+    if action in ("post_add", "post_remove"):
+        order_ids = pk_set
+    elif action == "post_clear":
+        order_ids = instance._cleared_order_ids
+    else:
+        return
+    Order.objects.recompute_totals_for(order_ids)
+    for order_id in order_ids:
+        bump_version(Order, object_scope(order_id))
+    user_ids = (
+        Order.objects
+        .filter(pk__in=order_ids)
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
+    for user_id in user_ids:
+        bump_version(Order, scope=user_id)
@@ -6,12 +6,16 @@ from .models import Product
 class ShopSitemap(Sitemap):
     changefreq = "never"
     priority = 0.5
+    # адрес строки - reverse(url_name, kwargs={"pk": pk})
+    url_name = "shopapp:product_details"
+    lastmod_field = "created_at"
 
     def items(self):
         return (
             Product.objects
-            .filter(created_at__isnull=False)
-            .order_by("-created_at")[:5]
+            .filter(archived=False)
+            .only("pk", self.lastmod_field)
+            .order_by("pk")
         )
 
     def lastmod(self, obj: Product):
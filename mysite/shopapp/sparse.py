@@ -0,0 +1,183 @@
+"""
+Выбор полей ответа REST API: ``?fields=pk,name,price`` и ``?expand=products``.
+
+``SparseFieldsMixin`` убирает из сериализатора неотобранные поля
+и подставляет вложенные сериализаторы вместо ``pk`` связанных объектов.
+По получившемуся набору полей ``narrow_queryset`` строит ``only()``,
+``select_related`` и ``prefetch_related``, так что число запросов
+и объём читаемых колонок зависят от того, что запросил клиент.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .versions import versioned_key
+
+
+def _split(value: str | None) -> list | None:
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Сериализатор с аргументами ``fields`` (имена полей, ``None`` - все)
+    и ``expand`` (имена из ``expandable_fields``).
+
+    ``expandable_fields`` - ``{имя поля: (класс сериализатора, kwargs)}``.
+    """
+
+    expandable_fields = {}
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expanded = set(expand)
+        for name in self.expanded:
+            serializer_class, serializer_kwargs = self.expandable_fields[name]
+            self.fields[name] = serializer_class(read_only=True, **serializer_kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def narrow_queryset(self, queryset, extra=()):
+        """
+        ``queryset`` с колонками и связями, которые нужны выбранным полям.
+
+        ``extra`` - поля модели, которые нужно прочитать дополнительно
+        (сортировка для keyset-курсора, ``updated_at`` для ``ETag``).
+        Поле без колонки в модели (свойство, ``source="*"``) отключает ``only()``.
+        """
+        meta = queryset.model._meta
+        columns = {meta.pk.name, *extra}
+        related = []
+        prefetches = []
+        narrow = True
+        for field in self.fields.values():
+            source = field.source.split(".")[0]
+            if source == "pk":
+                continue
+            try:
+                model_field = meta.get_field(source)
+            except FieldDoesNotExist:
+                narrow = False
+                continue
+
+            serializer = getattr(field, "child", field)
+            if isinstance(serializer, SparseFieldsMixin):
+                # вложенный объект: его колонки читаются тем же способом
+                related_model = model_field.related_model
+                if model_field.many_to_many or model_field.one_to_many:
+                    extra_columns = ()
+                    if model_field.one_to_many:
+                        # prefetch сопоставляет строки по внешнему ключу
+                        extra_columns = (model_field.field.attname,)
+                    nested = serializer.narrow_queryset(
+                        related_model._default_manager.all(), extra_columns,
+                    )
+                    prefetches.append(Prefetch(source, queryset=nested))
+                else:
+                    columns.add(source)
+                    related.append(source)
+                    columns.update(
+                        f"{source}__{name}"
+                        for name in serializer.narrow_columns(related_model)
+                    )
+            elif isinstance(field, serializers.ManyRelatedField):
+                # список pk: один запрос на все строки, а не по запросу на строку;
+                # pk в сортировке - одинаковый порядок при равных полях Meta.ordering
+                related_model = model_field.related_model
+                pks = related_model._default_manager.only("pk").order_by(
+                    *related_model._meta.ordering, "pk",
+                )
+                prefetches.append(Prefetch(source, queryset=pks))
+            elif model_field.concrete:
+                columns.add(source)
+
+        if related:
+            queryset = queryset.select_related(*related)
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        if narrow:
+            queryset = queryset.only(*columns)
+        return queryset
+
+    def narrow_columns(self, model) -> list:
+        """Колонки ``model``, которые читает этот сериализатор (для ``select_related``)."""
+        meta = model._meta
+        columns = [meta.pk.name]
+        for field in self.fields.values():
+            try:
+                model_field = meta.get_field(field.source.split(".")[0])
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete:
+                columns.append(model_field.name)
+        return columns
+
+
+class SparseFieldsViewSetMixin:
+    """
+    Передаёт ``?fields=``/``?expand=`` сериализатору в ``list`` и ``retrieve``
+    и сужает queryset под выбранные поля. Ставится перед
+    ``ConditionalViewSetMixin``: в ``ETag`` добавляются версии моделей
+    раскрытых связей.
+    """
+
+    fields_query_param = "fields"
+    expand_query_param = "expand"
+    sparse_actions = ("list", "retrieve")
+
+    def get_sparse_fields(self) -> dict:
+        """``{"fields": [...] | None, "expand": [...]}`` из запроса; 400 на неизвестные имена."""
+        if self.action not in self.sparse_actions:
+            return {}
+        params = self.request.query_params
+        fields = _split(params.get(self.fields_query_param))
+        expand = _split(params.get(self.expand_query_param)) or []
+
+        serializer_class = self.get_serializer_class()
+        errors = {}
+        unknown = set(expand) - set(serializer_class.expandable_fields)
+        if unknown:
+            errors[self.expand_query_param] = [f"Unknown fields: {', '.join(sorted(unknown))}"]
+        if fields is not None:
+            unknown = set(fields) - set(serializer_class().fields) - set(expand)
+            if unknown:
+                errors[self.fields_query_param] = [f"Unknown fields: {', '.join(sorted(unknown))}"]
+        if errors:
+            raise ValidationError(errors)
+        return {"fields": fields, "expand": expand}
+
+    def get_serializer(self, *args, **kwargs):
+        if not hasattr(self, "_sparse_fields"):
+            self._sparse_fields = self.get_sparse_fields()
+        for key, value in self._sparse_fields.items():
+            kwargs.setdefault(key, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_etag(self, request, *state) -> str:
+        # вложенные объекты меняются, не трогая updated_at строк списка
+        expand = getattr(self, "_sparse_fields", {}).get("expand")
+        if expand:
+            expandable = self.get_serializer_class().expandable_fields
+            models = [expandable[name][0].Meta.model for name in sorted(expand)]
+            state = (*state, versioned_key("expand", *models))
+        return super().get_etag(request, *state)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action not in self.sparse_actions:
+            return queryset
+        meta = queryset.model._meta
+        # поля сортировки нужны keyset-курсору для позиции последней строки
+        ordering = queryset.query.order_by or meta.ordering
+        extra = [getattr(self, "updated_field", None)]
+        for name in ordering:
+            if isinstance(name, str):
+                try:
+                    extra.append(meta.get_field(name.lstrip("-")).name)
+                except FieldDoesNotExist:
+                    pass
+        return self.get_serializer().narrow_queryset(queryset, [name for name in extra if name])
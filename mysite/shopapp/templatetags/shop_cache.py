@@ -0,0 +1,118 @@
+"""
+Кеш фрагментов шаблона для отдельных объектов.
+
+Ключ фрагмента строится из имени, модели, pk, версий объекта
+(``versions.object_scope``), массовых изменений модели и языка::
+
+    {% load shop_cache %}
+    {% prefetch_fragments "product_card" products %}
+    {% for product in products %}
+      {% object_cache "product_card" product %}
+        ...
+      {% endobject_cache %}
+    {% endfor %}
+
+``prefetch_fragments`` читает фрагменты всех объектов страницы одним
+``get_many``, ``object_cache`` без него обращается к кешу сам.
+Дополнительные аргументы - метки моделей (``"shopapp.Product"``),
+любое изменение которых тоже сбрасывает фрагмент.
+"""
+from django import template
+from django.apps import apps
+from django.core.cache import cache
+from django.utils import translation
+
+from ..versions import BULK_SCOPE, get_versions, object_scope
+
+
+register = template.Library()
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+PREFETCHED = "shop_cache_fragments"
+
+
+def fragment_keys(name: str, objects, depends_on=()) -> dict:
+    """Ключи кеша фрагментов ``{pk: key}`` для объектов одной модели."""
+    if not objects:
+        return {}
+    model = type(objects[0])
+    shared = [(model, BULK_SCOPE)] + [(apps.get_model(label), None) for label in depends_on]
+    scopes = shared + [(model, object_scope(obj.pk)) for obj in objects]
+    versions = get_versions(scopes)
+
+    prefix = f"fragment:{name}:{model._meta.label_lower}"
+    shared_version = ".".join(str(versions[item]) for item in shared)
+    language = translation.get_language()
+    return {
+        obj.pk: (
+            f"{prefix}:{obj.pk}:v{shared_version}."
+            f"{versions[(model, object_scope(obj.pk))]}:{language}"
+        )
+        for obj in objects
+    }
+
+
+def _parse_arguments(parser, token, minimum):
+    bits = token.split_contents()
+    if len(bits) < minimum + 1:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' tag requires at least {minimum} arguments."
+        )
+    return [parser.compile_filter(bit) for bit in bits[1:]]
+
+
+class PrefetchFragmentsNode(template.Node):
+    def __init__(self, name, objects, depends_on):
+        self.name = name
+        self.objects = objects
+        self.depends_on = depends_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        objects = list(self.objects.resolve(context) or [])
+        depends_on = [label.resolve(context) for label in self.depends_on]
+        keys = fragment_keys(name, objects, depends_on)
+        found = cache.get_many(keys.values()) if keys else {}
+        prefetched = context.render_context.setdefault(PREFETCHED, {})
+        prefetched[name] = {pk: (key, found.get(key)) for pk, key in keys.items()}
+        return ""
+
+
+class ObjectCacheNode(template.Node):
+    def __init__(self, nodelist, name, obj, depends_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.obj = obj
+        self.depends_on = depends_on
+
+    def render(self, context):
+        name = self.name.resolve(context)
+        obj = self.obj.resolve(context)
+        prefetched = context.render_context.get(PREFETCHED, {}).get(name, {})
+        if obj.pk in prefetched:
+            key, value = prefetched[obj.pk]
+        else:
+            depends_on = [label.resolve(context) for label in self.depends_on]
+            key = fragment_keys(name, [obj], depends_on)[obj.pk]
+            value = cache.get(key)
+
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(key, value, FRAGMENT_TIMEOUT)
+        return value
+
+
+@register.tag
+def prefetch_fragments(parser, token):
+    """``{% prefetch_fragments name objects [model_label ...] %}``"""
+    name, objects, *depends_on = _parse_arguments(parser, token, 2)
+    return PrefetchFragmentsNode(name, objects, depends_on)
+
+
+@register.tag
+def object_cache(parser, token):
+    """``{% object_cache name obj [model_label ...] %} ... {% endobject_cache %}``"""
+    name, obj, *depends_on = _parse_arguments(parser, token, 2)
+    nodelist = parser.parse(("endobject_cache",))
+    parser.delete_first_token()
+    return ObjectCacheNode(nodelist, name, obj, depends_on)
@@ -0,0 +1,46 @@
+"""
+Адаптивные картинки из вариантов ``shopapp.images``::
+
+    {% load shop_images %}
+    {% picture product.preview alt=product.name sizes="240px" style="height:150px;" %}
+
+Пока варианты не построены, выводится обычный ``<img>`` с оригиналом.
+"""
+from django import template
+from django.utils.html import format_html
+
+from ..images import WEBP, variant_srcset
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_srcset(field_file, extension=None):
+    """Значение ``srcset`` для своего ``<img>``."""
+    return variant_srcset(field_file, extension)
+
+
+@register.simple_tag
+def picture(field_file, alt="", sizes="100vw", style=""):
+    """``<picture>`` с WebP и исходным форматом разной ширины."""
+    if not field_file:
+        return ""
+    img = format_html(
+        '<img src="{}" alt="{}" style="{}" loading="lazy"',
+        field_file.url,
+        alt,
+        style,
+    )
+    srcset = variant_srcset(field_file)
+    if not srcset:
+        return format_html("{}>", img)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '{} srcset="{}" sizes="{}"></picture>',
+        variant_srcset(field_file, WEBP),
+        sizes,
+        img,
+        srcset,
+        sizes,
+    )
@@ -0,0 +1,91 @@
+"""
+Пакетная загрузка картинок товара.
+
+Вместо ``ProductImage.objects.create`` на каждый файл (запись файла
+и INSERT по очереди) файлы проверяются Pillow и записываются в storage
+параллельно в потоках (``IMAGE_UPLOAD_WORKERS``), а строки создаются
+одним ``bulk_create``. Используется формой изменения товара и действием
+``upload_images`` API.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from mysite.db import atomic_retry
+
+from .images import queue_variants
+from .models import Product, ProductImage
+from .versions import bump_version, object_scope
+
+
+def _map(function, items) -> list:
+    items = list(items)
+    if len(items) < 2:
+        return [function(item) for item in items]
+    workers = min(settings.IMAGE_UPLOAD_WORKERS, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, items))
+
+
+def _validate(file):
+    try:
+        return forms.ImageField().clean(file), None
+    except ValidationError as exc:
+        return None, ValidationError(
+            "%(name)s: %(error)s",
+            code=exc.error_list[0].code,
+            params={"name": file.name, "error": exc.messages[0]},
+        )
+
+
+def validate_images(files) -> list:
+    """
+    Проверяет файлы Pillow параллельно.
+
+    Ошибки всех файлов собираются в одну ``ValidationError``.
+    """
+    results = _map(_validate, files)
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        raise ValidationError(errors)
+    return [file for file, _ in results]
+
+
+def attach_images(product: Product, files, description: str = "", validate: bool = True) -> list:
+    """
+    Добавляет товару картинки: параллельная запись файлов, один INSERT.
+
+    Если INSERT не удался, записанные файлы удаляются. ``post_save`` для
+    ``bulk_create`` не вызывается, поэтому версия и ``updated_at`` товара
+    обновляются и варианты картинок ставятся в очередь здесь.
+    """
+    files = list(files)
+    if validate:
+        files = validate_images(files)
+    if not files:
+        return []
+
+    images = [ProductImage(product=product, description=description) for _ in files]
+
+    def store(item):
+        image, file = item
+        image.image.save(file.name, file, save=False)
+
+    @atomic_retry
+    def insert():
+        created = ProductImage.objects.bulk_create(images)
+        bump_version(Product, object_scope(product.pk))
+        Product.objects.filter(pk=product.pk).touch()
+        return created
+
+    _map(store, zip(images, files))
+    try:
+        images = insert()
+    except Exception:
+        for image in images:
+            image.image.delete(save=False)
+        raise
+    queue_variants(images, "image")
+    return images
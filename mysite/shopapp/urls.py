@@ -18,6 +18,7 @@ from .views import (
     OrdersExportView,
     ProductViewSet,
     OrderViewSet,
+    ImportJobViewSet,
     LatestProductsFeed,
     UserOrdersListView,
     UserOrdersExportView,
@@ -28,6 +29,7 @@ app_name = "shopapp"
 routers = DefaultRouter()
 routers.register("products", ProductViewSet)
 routers.register("orders", OrderViewSet)
+routers.register("import-jobs", ImportJobViewSet)
 
 urlpatterns = [
     # path("", cache_page(60 * 3)(ShopIndexView.as_view()), name="index"),
@@ -0,0 +1,258 @@
+"""
+Быстрое чтение списков REST API через ``values()``.
+
+``ModelSerializer`` на каждую строку создаёт модель, а на каждое поле
+вызывает ``get_attribute`` и ``to_representation``. ``ValuesRows``
+один раз на запрос разбирает поля сериализатора в пары
+"колонка ``values()`` - конвертер" (``Decimal``, дата, адрес файла)
+и собирает ответ прямо из словарей ``values()``, не создавая моделей.
+Вывод совпадает с сериализатором байт в байт.
+
+Поля, которые так собрать нельзя (вложенные сериализаторы,
+``SerializerMethodField``, свои ``to_representation``), возвращают
+обычный путь через сериализатор.
+"""
+import decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+def _identity(value):
+    return value
+
+
+def _bigint_converter(field, model_field, context):
+    if getattr(field, "coerce_to_string", api_settings.COERCE_BIGINT_TO_STRING):
+        return str
+    return int
+
+
+def _datetime_converter(field, model_field, context):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        # значения из базы при USE_TZ уже aware, как и у модели
+        value = value.astimezone(timezone).isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+    return convert
+
+
+def _decimal_converter(field, model_field, context):
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+
+    exponent = decimal.Decimal(".1") ** field.decimal_places
+    rounding = field.rounding
+    quantize_context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        quantize_context.prec = field.max_digits
+
+    def convert(value):
+        return f"{value.quantize(exponent, rounding=rounding, context=quantize_context):f}"
+    return convert
+
+
+def _file_converter(field, model_field, context):
+    if not getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL):
+        return lambda name: name or None
+    storage = model_field.storage
+    request = context.get("request")
+
+    def convert(name):
+        if not name:
+            return None
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+def _field_file_converter(field, model_field, context):
+    # своё to_representation у файлового поля: отдаём ему FieldFile без модели
+    attr_class = model_field.attr_class
+
+    def convert(name):
+        return field.to_representation(attr_class(None, model_field, name))
+    return convert
+
+
+def _related_pk_converter(field, model_field, context):
+    if field.pk_field is not None:
+        return None
+    return _identity
+
+
+# класс, в котором определён to_representation поля -> фабрика конвертера
+CONVERTERS = {
+    serializers.ReadOnlyField: lambda field, model_field, context: _identity,
+    serializers.IntegerField: lambda field, model_field, context: int,
+    serializers.BigIntegerField: _bigint_converter,
+    serializers.CharField: lambda field, model_field, context: str,
+    serializers.BooleanField: lambda field, model_field, context: bool,
+    serializers.DateTimeField: _datetime_converter,
+    serializers.DecimalField: _decimal_converter,
+    serializers.FileField: _file_converter,
+    serializers.PrimaryKeyRelatedField: _related_pk_converter,
+}
+
+
+def _representation_class(field):
+    for klass in type(field).__mro__:
+        if "to_representation" in vars(klass):
+            return klass
+    return None
+
+
+class ValuesRows:
+    """
+    Поля сериализатора, скомпилированные для строк ``values()``.
+
+    ``fields`` - ``(имя в ответе, колонка, конвертер)``,
+    ``many`` - ``(имя в ответе, поле модели)`` для списков ``pk`` связи
+    многие-ко-многим, они читаются одним запросом на страницу.
+    """
+
+    def __init__(self, model, fields, many):
+        self.model = model
+        self.fields = fields
+        self.many = many
+
+    @classmethod
+    def compile(cls, serializer):
+        """``ValuesRows`` для сериализатора или ``None``, если поле не поддержано."""
+        if type(serializer).to_representation is not serializers.Serializer.to_representation:
+            return None
+        meta = serializer.Meta.model._meta
+        fields, many = [], []
+        for field in serializer._readable_fields:
+            source = field.source
+            if source == "pk":
+                model_field = meta.pk
+                column = "pk"
+            else:
+                if "." in source:
+                    return None
+                try:
+                    model_field = meta.get_field(source)
+                except FieldDoesNotExist:
+                    return None
+                column = model_field.attname if model_field.concrete else None
+
+            if isinstance(field, serializers.ManyRelatedField):
+                child = field.child_relation
+                if not (isinstance(model_field, models.ManyToManyField)
+                        and type(child) is serializers.PrimaryKeyRelatedField
+                        and child.pk_field is None):
+                    return None
+                many.append((field.field_name, model_field))
+                fields.append((field.field_name, None, None))
+                continue
+
+            if column is None:
+                return None
+            factory = CONVERTERS.get(_representation_class(field))
+            if factory is None and isinstance(field, serializers.FileField):
+                factory = _field_file_converter
+            converter = factory(field, model_field, serializer.context) if factory else None
+            if converter is None:
+                return None
+            fields.append((field.field_name, column, converter))
+        return cls(serializer.Meta.model, fields, many)
+
+    def prepare(self, queryset):
+        """
+        ``values()`` с колонками полей и сортировки, включая аннотации
+        (её читает keyset-курсор).
+        """
+        meta = self.model._meta
+        columns = {"pk"}
+        columns.update(column for _, column, _ in self.fields if column)
+        for name in queryset.query.order_by or meta.ordering:
+            if not isinstance(name, str):
+                continue
+            name = name.lstrip("-")
+            if name in queryset.query.annotations:
+                # например search_rank из поиска: его читает курсор
+                columns.add(name)
+                continue
+            try:
+                columns.add("pk" if name == "pk" else meta.get_field(name).attname)
+            except FieldDoesNotExist:
+                pass
+        if not queryset.ordered:
+            # без сортировки SQLite может прочитать узкий values() по покрывающему
+            # индексу, и порядок строк разойдётся с обычным путём (обход таблицы)
+            queryset = queryset.order_by("pk")
+        return queryset.prefetch_related(None).values(*sorted(columns))
+
+    def related_pks(self, model_field, pks) -> dict:
+        """
+        ``{pk строки: [pk связанных]}`` в порядке ``Meta.ordering`` связанной
+        модели и ``pk`` - как в ``Prefetch`` из ``SparseFieldsMixin``.
+        """
+        through = model_field.remote_field.through
+        source = model_field.m2m_field_name()
+        target = model_field.m2m_reverse_field_name()
+        ordering = [
+            f"-{target}__{name[1:]}" if name.startswith("-") else f"{target}__{name}"
+            for name in [*model_field.related_model._meta.ordering, "pk"]
+        ]
+        links = (
+            through._default_manager
+            .filter(**{f"{source}__in": pks})
+            .order_by(*ordering)
+            .values_list(f"{source}_id", f"{target}_id")
+        )
+        related = {pk: [] for pk in pks}
+        for pk, related_pk in links:
+            related[pk].append(related_pk)
+        return related
+
+    def convert(self, rows) -> list:
+        rows = list(rows)
+        many = {}
+        if self.many and rows:
+            pks = [row["pk"] for row in rows]
+            many = {name: self.related_pks(model_field, pks) for name, model_field in self.many}
+
+        fields = self.fields
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert in fields:
+                if column is None:
+                    item[name] = many[name][row["pk"]]
+                    continue
+                value = row[column]
+                item[name] = None if value is None else convert(value)
+            data.append(item)
+        return data
+
+
+class ValuesListViewSetMixin:
+    """
+    ``list`` через ``ValuesRows``, если сериализатор это позволяет.
+
+    Ставится после ``ConditionalViewSetMixin``: 304 и кеш по ``ETag``
+    срабатывают раньше. Включается в представлении: ``fast_list = True``.
+    """
+
+    fast_list = False
+
+    def list(self, request, *args, **kwargs):
+        rows = ValuesRows.compile(self.get_serializer()) if self.fast_list else None
+        if rows is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = rows.prepare(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(rows.convert(page))
+        return Response(rows.convert(queryset))
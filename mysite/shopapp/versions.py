@@ -0,0 +1,291 @@
+"""
+Реестр версий моделей для ключей кеша.
+
+Каждое изменение модели (сигналы save/delete и массовые операции
+``VersionedQuerySet``) увеличивает счётчик версии в кеше. Версия входит
+в ключ закешированных данных, поэтому после изменения старые записи
+просто перестают читаться и их не нужно искать и удалять.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import models, transaction
+from django.utils import timezone
+
+
+def _version_key(model, scope=None) -> str:
+    key = f"model_version:{model._meta.label_lower}"
+    if scope is not None:
+        key = f"{key}:{scope}"
+    return key
+
+
+def _initial_version() -> int:
+    # Если счётчик вытеснили из кеша, новое значение не совпадёт
+    # ни с одной из уже выданных версий.
+    return time.time_ns() // 1000
+
+
+def get_version(model, scope=None) -> int:
+    key = _version_key(model, scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(scopes) -> dict:
+    """
+    Версии сразу для нескольких пар ``(model, scope)`` одним ``get_many``.
+    """
+    keys = {item: _version_key(*item) for item in scopes}
+    found = cache.get_many(keys.values())
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_version(), timeout=None)
+        found.update(cache.get_many(missing))
+    return {item: found[key] for item, key in keys.items()}
+
+
+async def aget_versions(scopes) -> dict:
+    """Асинхронный ``get_versions``."""
+    keys = {item: _version_key(*item) for item in scopes}
+    found = await cache.aget_many(keys.values())
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, _initial_version(), timeout=None)
+        found.update(await cache.aget_many(missing))
+    return {item: found[key] for item, key in keys.items()}
+
+
+def object_scope(pk) -> str:
+    """Scope версии отдельного объекта."""
+    return f"pk:{pk}"
+
+
+def _incr_version(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+
+
+def bump_version(model, scope=None) -> None:
+    """
+    Увеличивает версию модели (или её части ``scope``, например пользователя).
+
+    Версия поднимается сразу и ещё раз после коммита транзакции: иначе
+    параллельный запрос мог бы закешировать ещё не закоммиченные
+    старые данные под новой версией.
+    """
+    key = _version_key(model, scope)
+    _incr_version(key)
+    transaction.on_commit(lambda: _incr_version(key))
+
+
+def versioned_key(name: str, *models_or_scopes) -> str:
+    """
+    Строит ключ кеша с версиями моделей.
+
+    Аргументы - модели или пары ``(model, scope)``.
+    """
+    scopes = _scopes(models_or_scopes)
+    return _format_key(name, scopes, get_versions(scopes))
+
+
+async def aversioned_key(name: str, *models_or_scopes) -> str:
+    """Асинхронный ``versioned_key``."""
+    scopes = _scopes(models_or_scopes)
+    return _format_key(name, scopes, await aget_versions(scopes))
+
+
+def _scopes(models_or_scopes) -> list:
+    return [
+        item if isinstance(item, tuple) else (item, None)
+        for item in models_or_scopes
+    ]
+
+
+def _format_key(name: str, scopes, versions) -> str:
+    return f"{name}:v{'.'.join(str(versions[item]) for item in scopes)}"
+
+
+_local_locks = weakref.WeakValueDictionary()
+_local_locks_guard = threading.Lock()
+
+
+def _local_lock(key: str) -> threading.Lock:
+    with _local_locks_guard:
+        lock = _local_locks.get(key)
+        if lock is None:
+            lock = _local_locks[key] = threading.Lock()
+        return lock
+
+
+def get_or_compute(key: str, compute, timeout: int,
+                   lock_timeout: int = 30, wait: float = 10.0):
+    """
+    Возвращает значение из кеша, а при промахе вычисляет его через ``compute``.
+
+    Одновременные промахи по одному ключу считают значение один раз:
+    потоки процесса ждут на локальной блокировке, другие процессы - на
+    блокировке в кеше (``cache.add``), пока первый не запишет результат.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _local_lock(key):
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+        lock_key = f"lock:{key}"
+        if cache.add(lock_key, 1, lock_timeout):
+            try:
+                value = compute()
+                cache.set(key, value, timeout)
+                return value
+            finally:
+                cache.delete(lock_key)
+
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+
+        # не дождались другого процесса - считаем сами
+        value = compute()
+        cache.set(key, value, timeout)
+        return value
+
+
+async def aget_or_compute(key: str, compute, timeout: int,
+                          lock_timeout: int = 30, wait: float = 10.0):
+    """
+    Асинхронный ``get_or_compute``; ``compute`` - корутинная функция.
+
+    Пока значение считает другой запрос, ожидание не занимает поток:
+    корутины процесса и другие процессы ждут на блокировке в кеше.
+    """
+    value = await cache.aget(key)
+    if value is not None:
+        return value
+
+    lock_key = f"lock:{key}"
+    if await cache.aadd(lock_key, 1, lock_timeout):
+        try:
+            value = await compute()
+            await cache.aset(key, value, timeout)
+            return value
+        finally:
+            await cache.adelete(lock_key)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        value = await cache.aget(key)
+        if value is not None:
+            return value
+
+    value = await compute()
+    await cache.aset(key, value, timeout)
+    return value
+
+
+def cached_count(queryset, *models_or_scopes, timeout: int = 60 * 60) -> int:
+    """
+    ``queryset.count()`` из кеша; ключ зависит от SQL запроса и версий
+    ``models_or_scopes``, поэтому изменения моделей сбрасывают счётчик.
+    """
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+    key = versioned_key(f"count:{queryset.model._meta.label_lower}:{digest}", *models_or_scopes)
+    return get_or_compute(key, queryset.count, timeout)
+
+
+BULK_SCOPE = "bulk"
+
+
+def _auto_now_fields(model) -> list:
+    return [
+        field for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False)
+    ]
+
+
+class VersionedQuerySet(models.QuerySet):
+    """
+    QuerySet, массовые операции которого тоже поднимают версию модели.
+
+    ``update()`` и ``bulk_update()`` не знают, какие именно объекты
+    изменились, поэтому поднимают ещё и версию ``BULK_SCOPE`` - она входит
+    в ключи кеша отдельных объектов (см. ``templatetags/shop_cache.py``).
+    Поля ``auto_now`` (``updated_at``) они обновляют так же, как ``save()``.
+    """
+
+    def update(self, **kwargs):
+        now = timezone.now()
+        for field in _auto_now_fields(self.model):
+            kwargs.setdefault(field.name, now)
+        rows = super().update(**kwargs)
+        if rows:
+            bump_version(self.model)
+            bump_version(self.model, BULK_SCOPE)
+        return rows
+
+    update.alters_data = True
+
+    def touch(self) -> int:
+        """Обновляет поля ``auto_now``, не поднимая версию модели."""
+        now = timezone.now()
+        return models.QuerySet.update(
+            self, **{field.name: now for field in _auto_now_fields(self.model)},
+        )
+
+    touch.alters_data = True
+
+    def delete(self):
+        result = super().delete()
+        if result[0]:
+            bump_version(self.model)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            bump_version(self.model)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        touched = [field for field in _auto_now_fields(self.model) if field.name not in fields]
+        if touched:
+            now = timezone.now()
+            for obj in objs:
+                for field in touched:
+                    setattr(obj, field.attname, now)
+            fields = [*fields, *(field.name for field in touched)]
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if rows:
+            bump_version(self.model)
+            bump_version(self.model, BULK_SCOPE)
+        return rows
+
+    bulk_update.alters_data = True
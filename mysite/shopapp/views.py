@@ -3,51 +3,72 @@
 
 Разные view интернет-магазина: по товарам, заказам и т.д.
 """
-from csv import DictWriter
 import logging
 from timeit import default_timer
 
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.mixins import LoginRequiredMixin, \
     PermissionRequiredMixin, UserPassesTestMixin
-from django.contrib.syndication.views import Feed
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Prefetch
+from django.db.models.functions import Substr
 from django.http import HttpResponse, HttpRequest, \
-    HttpResponseRedirect, JsonResponse
-from django.shortcuts import render, redirect, get_object_or_404, reverse
+    HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404, reverse, \
+    aget_object_or_404
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views import View
-from django.views.decorators.cache import cache_page
 from django.views.generic import ListView, DetailView, \
     CreateView, UpdateView, DeleteView
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter, OrderingFilter
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .common import save_csv_model
+from mysite.db import atomic_retry
+from mysite.feeds import CachedFeed
+
+from .conditional import ConditionalViewSetMixin
+from .exports import stream_csv_response, iter_json_object, \
+    iter_orders_export, aiter_json_object, aiter_orders_export
 from .forms import GroupForm, ProductForm
-from .models import Product, Order, ProductImage
-from .serializers import ProductSerializers, OrderSerializers
+from .jobs import create_import_job
+from .models import Product, Order, ProductImage, ImportJob
+from .pagination import ShopPagination, KeysetListMixin
+from .search import ProductSearchFilter
+from .serializers import ProductSerializers, OrderSerializers, \
+    ImportJobSerializers, ProductImageSerializers
+from .sparse import SparseFieldsViewSetMixin
+from .uploads import attach_images
+from .values import ValuesListViewSetMixin
+from .versions import aversioned_key, aget_or_compute
 
 
 log = logging.getLogger(__name__)
 
 
-class LatestProductsFeed(Feed):
+class LatestProductsFeed(CachedFeed):
     title = "Shop products(latets)"
     description = "Updates on changes products shop"
     link = reverse_lazy("shopapp:products_list")
+    timestamp_field = "created_at"
+
+    def get_queryset(self):
+        return Product.objects.filter(created_at__isnull=False)
 
     def items(self):
         return (
-            Product.objects
-            .filter(created_at__isnull=False)
+            self.get_queryset()
+            .only("pk", "name", "created_at")
+            .annotate(summary=Substr("description", 1, 100))
             .order_by("-created_at")[:5]
         )
 
@@ -55,11 +76,19 @@ class LatestProductsFeed(Feed):
         return item.name
 
     def item_description(self, item: Product):
-        return item.description[:100]
+        return item.summary
+
+    def item_pubdate(self, item: Product):
+        return item.created_at
 
 
 @extend_schema(description='Product views CRUD')
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(
+    SparseFieldsViewSetMixin,
+    ConditionalViewSetMixin,
+    ValuesListViewSetMixin,
+    ModelViewSet,
+):
     """
     Набор представлений для действий над Product.
 
@@ -69,10 +98,13 @@ class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializers
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
+    pagination_class = ShopPagination
+    count_versions = (Product,)
+    fast_list = True
     search_fields = ["name", "description"]
     filterset_fields = [
         "name",
@@ -85,6 +117,9 @@ class ProductViewSet(ModelViewSet):
         "name",
         "price",
         "discount",
+        "id",
+        "created_at",
+        "updated_at",
     ]
 
 
@@ -96,8 +131,6 @@ class ProductViewSet(ModelViewSet):
             404: OpenApiResponse(description="Empty responce, product by ID not found"),
         }
     )
-
-    @method_decorator(cache_page(60 * 2))
     def list(self, *args, **kwargs):
         # print(("hello products list"))
         return super().list(*args, **kwargs)
@@ -110,9 +143,6 @@ class ProductViewSet(ModelViewSet):
 
     @action(methods=["get"], detail=False)
     def download_csv(self, request:Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "products-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
         queryset = self.filter_queryset(self.get_queryset())
         fields = [
             "name",
@@ -120,34 +150,83 @@ class ProductViewSet(ModelViewSet):
             "description",
             "discount",
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for product in queryset:
-            writer.writerow({
-                field:getattr(product, field)
-                for field in fields
-            })
-        return response
+        return stream_csv_response(
+            queryset,
+            header=fields,
+            columns=fields,
+            filename="products-export.csv",
+        )
 
+    @extend_schema(
+        summary="Attach images to product",
+        description="Uploads all `images` files at once; "
+                    "the request fails as a whole if any file is not an image",
+        responses={
+            201: ProductImageSerializers(many=True),
+            400: OpenApiResponse(description="Invalid image files"),
+        },
+    )
     @action(
         methods=["post"],
-        detail=False,
+        detail=True,
         parser_classes=[MultiPartParser]
     )
+    def upload_images(self, request:Request, pk=None):
+        product = self.get_object()
+        files = request.FILES.getlist("images")
+        if not files:
+            return Response({"images": ["No files were submitted."]}, status=400)
+        try:
+            images = attach_images(
+                product,
+                files,
+                description=request.data.get("description", ""),
+            )
+        except ValidationError as exc:
+            return Response({"images": exc.messages}, status=400)
+        serializer = ProductImageSerializers(
+            images,
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data, status=201)
+
+    @action(
+        methods=["post"],
+        detail=False,
+        parser_classes=[MultiPartParser],
+        # статус задачи (status_url) видит только её автор
+        permission_classes=[IsAuthenticated],
+    )
     def upload_csv(self, request:Request):
-        products = save_csv_model(
-            request.FILES['file'].file,
+        job = create_import_job(
+            request.FILES['file'],
+            model=self.queryset.model,
             encoding=request.encoding,
-            model=self.model,
+            user=request.user,
         )
-        serializer = self.get_serializer(products, many=True)
-        return Response(serializer.data)
+        return import_job_response(request, job)
+
+def import_job_response(request: Request, job: ImportJob) -> Response:
+    serializer = ImportJobSerializers(job)
+    status_url = reverse("shopapp:importjob-detail", kwargs={"pk": job.pk})
+    return Response(
+        {**serializer.data, "status_url": request.build_absolute_uri(status_url)},
+        status=202,
+    )
 
-class OrderViewSet(ModelViewSet):
+
+class OrderViewSet(
+    SparseFieldsViewSetMixin,
+    ConditionalViewSetMixin,
+    ValuesListViewSetMixin,
+    ModelViewSet,
+):
     queryset = Order.objects.all()
     serializer_class = OrderSerializers
+    pagination_class = ShopPagination
+    count_versions = (Order, (Order, "rows"))
+    fast_list = True
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -160,18 +239,20 @@ class OrderViewSet(ModelViewSet):
         "created_at",
         "user",
         "products",
+        "total",
+        "products_count",
     ]
     ordering_fields = [
         "id",
         "user",
         "created_at",
+        "updated_at",
+        "total",
+        "products_count",
     ]
 
     @action(methods=["get"], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type="text/csv")
-        filename = "orders-export.csv"
-        response["Content-Disposition"] = f"attachment; filename={filename}"
         queryset = self.filter_queryset(self.get_queryset())
         fields = [
             "delivery_address",
@@ -179,30 +260,54 @@ class OrderViewSet(ModelViewSet):
             "created_at",
             "user",
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
-
-        for order in queryset:
-            writer.writerow({
-                field: getattr(order, field)
-                for field in fields
-            })
-        return response
+        # пользователь подтягивается join'ом в том же запросе, а не по запросу на строку
+        columns = [
+            "delivery_address",
+            "promocode",
+            "created_at",
+            "user__username",
+        ]
+        return stream_csv_response(
+            queryset,
+            header=fields,
+            columns=columns,
+            filename="orders-export.csv",
+        )
 
     @action(
         methods=["post"],
         detail=False,
-        parser_classes=[MultiPartParser]
+        parser_classes=[MultiPartParser],
+        # статус задачи (status_url) видит только её автор
+        permission_classes=[IsAuthenticated],
     )
     def upload_csv(self, request: Request):
-        orders = save_csv_model(
-            request.FILES['file'].file,
+        job = create_import_job(
+            request.FILES['file'],
+            model=self.queryset.model,
             encoding=request.encoding,
-            model=self.model,
+            user=request.user,
         )
-        serializer = self.get_serializer(orders, many=True)
-        return Response(serializer.data)
+        return import_job_response(request, job)
+
+
+class ImportJobViewSet(ReadOnlyModelViewSet):
+    """
+    Статус фоновых задач импорта CSV.
+
+    Клиенты опрашивают задачу, которую вернул ``upload_csv``.
+    Пользователь видит только свои задачи, персонал - все.
+    """
+
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializers
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.is_staff:
+            return queryset
+        return queryset.filter(created_by=self.request.user)
 
 
 class ShopIndexView(View):
@@ -244,14 +349,16 @@ class GroupsListView(View):
 class ProductDetailsView(DetailView):
     template_name = "shopapp/products-details.html"
     # model = Product
-    queryset = Product.objects.prefetch_related("images")
+    # картинки читаются шаблоном только при промахе кеша фрагмента
+    queryset = Product.objects.all()
     context_object_name = "product"
 
 
-class ProductsListView(ListView):
+class ProductsListView(KeysetListMixin, ListView):
     template_name = "shopapp/products-list.html"
     context_object_name = "products"
     queryset = Product.objects.filter(archived=False)
+    count_versions = (Product,)
 
 
 class ProductCreateView(UserPassesTestMixin, CreateView):
@@ -290,12 +397,7 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
 
     def form_valid(self, form):
         responce = super().form_valid(form)
-        for image in form.files.getlist("images"):
-            ProductImage.objects.create(
-                product=self.object,
-                image=image,
-            )
-
+        attach_images(self.object, form.cleaned_data["images"], validate=False)
         return responce
 
 
@@ -311,12 +413,16 @@ class ProductDeleteView(DeleteView):
         return HttpResponseRedirect(success_url)
 
 
-class OrdersListView(LoginRequiredMixin, ListView):
+class OrdersListView(LoginRequiredMixin, KeysetListMixin, ListView):
     queryset = (
         Order.objects
         .select_related("user")
-        .prefetch_related("products")
+        .prefetch_related(
+            Prefetch("products", queryset=Product.objects.only("pk", "name", "price"))
+        )
+        .order_by("-pk")
     )
+    count_versions = (Order, (Order, "rows"))
 
 
 class OrderDetailView(PermissionRequiredMixin, DetailView):
@@ -333,6 +439,10 @@ class OrderCreateView(CreateView):
     fields = "delivery_address", "promocode", "user", "products"
     success_url = reverse_lazy('shopapp:orders_list')
 
+    @method_decorator(atomic_retry)
+    def form_valid(self, form):
+        return super().form_valid(form)
+
 
 class OrderUpdateView(UpdateView):
     model = Order
@@ -352,47 +462,80 @@ class OrderDeleteView(DeleteView):
 
 
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = "products_data_export"
-        products_data = cache.get(cache_key)
+    async def get(self, request: HttpRequest) -> JsonResponse:
+        # версия в ключе меняется при любом изменении товаров,
+        # поэтому кеш пишется только при промахе и не бывает устаревшим
+        cache_key = await aversioned_key("products_data_export", Product)
+        products_data = await cache.aget(cache_key)
         if products_data is None:
-            products = Product.objects.order_by("pk").all()
             products_data = [
-                {
-                    "pk": product.pk,
-                    "name": product.name,
-                    "price": product.price,
-                    "archived": product.archived,
-                }
-                for product in products
+                product
+                async for product in (
+                    Product.objects
+                    .order_by("pk")
+                    .values("pk", "name", "price", "archived")
+                )
             ]
-        cache.set(cache_key, products_data, 300)
-        # elem = products_data[0]
-        # name = elem["name"]
-        # print(name)
+            await cache.aset(cache_key, products_data, 300)
         return JsonResponse({"products": products_data})
 
 
 class OrdersExportView(View):
+    """
+    Выгрузка заказов в JSON.
 
-    def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by("id").all()
-        orders_data = [
-            {
-                "id": order.id,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "user_id": order.user_id,
-                "product_id": list(
-                    order.products.values_list("id", flat=True)
-                ),
-            }
-            for order in orders
-        ]
-        return JsonResponse({"orders": orders_data})
+    Ответ отдаётся потоком, а заказы с товарами читаются кусками.
+    Параметры ``since_id`` и ``limit`` позволяют выгружать заказы окнами:
+    при указанном ``limit`` в ответе есть ``next_since_id`` для следующего окна.
+    Представление асинхронное: под ASGI медленный клиент не занимает воркер.
+    """
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        try:
+            since_id = int(request.GET.get("since_id", 0))
+            limit = request.GET.get("limit")
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            return JsonResponse(
+                {"error": "since_id and limit must be integers"},
+                status=400,
+            )
+        if since_id < 0 or (limit is not None and limit < 1):
+            return JsonResponse(
+                {"error": "since_id must be >= 0 and limit must be >= 1"},
+                status=400,
+            )
 
+        exported = {"count": 0, "last_id": None}
 
-class UserOrdersListView(LoginRequiredMixin, ListView):
+        def count(order):
+            exported["count"] += 1
+            exported["last_id"] = order["id"]
+            return order
+
+        async def aorders():
+            async for order in aiter_orders_export(since_id=since_id, limit=limit):
+                yield count(order)
+
+        def orders():
+            for order in iter_orders_export(since_id=since_id, limit=limit):
+                yield count(order)
+
+        def next_window():
+            if limit is None:
+                return {}
+            has_more = exported["count"] == limit
+            return {"next_since_id": exported["last_id"] if has_more else None}
+
+        # WSGI-сервер собрал бы асинхронный поток в памяти целиком
+        if isinstance(request, ASGIRequest):
+            content = aiter_json_object("orders", aorders(), extra=next_window)
+        else:
+            content = iter_json_object("orders", orders(), extra=next_window)
+        return StreamingHttpResponse(content, content_type="application/json")
+
+
+class UserOrdersListView(LoginRequiredMixin, KeysetListMixin, ListView):
     model = Order
     template_name = "shopapp/user_orders_list.html"
     context_object_name = "user_orders"
@@ -400,7 +543,17 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
     def  get_queryset(self):
         user_id = self.kwargs["user_id"]
         self.owner = get_object_or_404(User, pk=user_id)
-        return Order.objects.filter(user=self.owner)
+        return (
+            Order.objects
+            .filter(user=self.owner)
+            .prefetch_related(
+                Prefetch("products", queryset=Product.objects.only("pk", "name", "price"))
+            )
+            .order_by("-pk")
+        )
+
+    def get_count_versions(self):
+        return Order, (Order, self.owner.pk)
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -410,17 +563,36 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
 
 class UserOrdersExportView(View):
 
-    # @method_decorator(cache_page(60 * 3))
-    def get(self, request: HttpRequest, user_id) -> JsonResponse:
-        cache_key = f"user_orders_{user_id}"
-        cached_data = cache.get(cache_key)
-
-        if cached_data is not None:
-            return JsonResponse({"orders": cached_data})
+    async def get(self, request: HttpRequest, user_id) -> JsonResponse:
+        # версии сбрасываются сигналами при изменении заказов пользователя,
+        # их товаров (m2m) и самих товаров
+        cache_key = await aversioned_key(
+            f"user_orders_{user_id}",
+            Order,
+            (Order, user_id),
+            Product,
+        )
+        orders_data = await aget_or_compute(
+            cache_key,
+            lambda: self.get_orders_data(user_id),
+            timeout=60 * 3,
+        )
+        return JsonResponse({"orders": orders_data})
 
-        user = get_object_or_404(User, pk=user_id)
-        orders = Order.objects.filter(user=user).order_by("pk")
-        orders_data = [
+    async def get_orders_data(self, user_id):
+        user = await aget_object_or_404(User, pk=user_id)
+        orders = (
+            Order.objects
+            .filter(user=user)
+            .order_by("pk")
+            .prefetch_related(
+                Prefetch(
+                    "products",
+                    queryset=Product.objects.only("pk", "name", "price"),
+                )
+            )
+        )
+        return [
             {
                 "id": order.id,
                 "delivery_address": order.delivery_address,
@@ -435,8 +607,5 @@ class UserOrdersExportView(View):
                     for product in order.products.all()
                 ],
             }
-            for order in orders
+            async for order in orders
         ]
-
-        cache.set(cache_key, orders_data, timeout=60 * 3)
-        return JsonResponse({"orders": orders_data})